@@ -0,0 +1,38 @@
+from fastapi import APIRouter
+
+from services.answer_cache import answer_cache_stats, clear_answer_cache
+from services.lexical_index import lexical_index
+from services.llm_client import single_flight_stats
+from services.question_cache import clear_question_cache, question_cache_stats
+from services.retrieval import embedding_cache_stats, query_batcher, result_cache_stats
+
+router = APIRouter(prefix="/api/admin", tags=["Admin"])
+
+
+@router.get("/retrieval/stats")
+async def retrieval_stats():
+    return {
+        "query_embedding_cache": embedding_cache_stats(),
+        "result_cache": result_cache_stats(),
+        "query_batcher": query_batcher.stats(),
+        "lexical_index": {"ready": lexical_index.ready, "chunks": len(lexical_index)},
+    }
+
+
+@router.get("/llm/stats")
+async def llm_stats():
+    return {
+        "question_cache": question_cache_stats(),
+        "answer_cache": answer_cache_stats(),
+        "single_flight": single_flight_stats(),
+    }
+
+
+@router.delete("/llm/question-cache")
+async def purge_question_cache():
+    return {"purged": clear_question_cache()}
+
+
+@router.delete("/llm/answer-cache")
+async def purge_answer_cache():
+    return {"purged": clear_answer_cache()}
@@ -10,9 +10,9 @@ from models.assignment import Assignment
 from models.attempt import Attempt
 from models.question import Question
 from models.user import User
-from services.chroma_service import collection
-from services.llm_service import generate_questions
 from services.mastery_service import upsert_mastery
+from services.question_cache import cached_generate_questions
+from services.retrieval import search
 
 router = APIRouter(prefix="/api/assignments", tags=["Assignments"])
 
@@ -200,23 +200,20 @@ async def generate_assignment_questions(
 
     topic = payload.topic or assignment.topic
     grade = payload.grade if payload.grade is not None else assignment.grade
-    query_kwargs = {
-        "query_texts": [topic],
-        "n_results": 5,
-        "include": ["documents"],
-    }
-    if grade is not None:
-        query_kwargs["where"] = {"grade": grade}
-
-    query_result = collection.query(**query_kwargs)
+    # Query trên partition của grade; partition rỗng thì tự fallback sang collection chung
+    query_result = await search(topic, n_results=5, grade=grade)
     documents = query_result.get("documents", [[]])[0]
-    if grade is not None and not documents:
-        query_kwargs.pop("where", None)
-        query_result = collection.query(**query_kwargs)
-        documents = query_result.get("documents", [[]])[0]
 
     try:
-        generated = await generate_questions(topic, documents, payload.count)
+        # Cả lớp cùng topic/grade/ngữ cảnh dùng chung một pool câu hỏi
+        generated = await cached_generate_questions(
+            topic,
+            grade,
+            query_result.get("ids", [[]])[0],
+            documents,
+            payload.count,
+            scores=query_result.get("scores", [[]])[0],
+        )
     except ValueError as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
 
@@ -1,14 +1,62 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends
+import os
+from datetime import datetime
 
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from pydantic import BaseModel
+
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from core.database import get_db
 from models.documents import Documents
-from services.document_pipeline import process_document
+from services.ingestion_jobs import IngestionJob, enqueue, get_active_job, get_job
+from services.upload_store import UploadTooLarge, store_upload
 from sqlalchemy import select
-from uuid import uuid4, UUID
-import shutil
+from uuid import UUID
 
 router = APIRouter(prefix="/api/admin", tags=["Documents"])
+
+
+class IngestionJobResponse(BaseModel):
+    job_id: str
+    document_id: str
+    status: str
+    pages_parsed: int
+    chunks_written: int
+    chunks_embedded: int
+    chunks_kept: int
+    chunks_deleted: int
+    attempts: int
+    error: str | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+
+def _job_response(job: IngestionJob) -> IngestionJobResponse:
+    return IngestionJobResponse(
+        job_id=job.id,
+        document_id=job.document_id,
+        status=job.status,
+        pages_parsed=job.progress.pages_parsed,
+        chunks_written=job.progress.chunks_written,
+        chunks_embedded=job.progress.chunks_embedded,
+        chunks_kept=job.progress.chunks_kept,
+        chunks_deleted=job.progress.chunks_deleted,
+        attempts=job.attempts,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
+
+
+async def _find_by_hash(db: AsyncSession, content_hash: str):
+    result = await db.execute(
+        select(Documents).where(Documents.content_hash == content_hash)
+    )
+    return result.scalar_one_or_none()
+
+
 @router.post("/documents")
 async def upload_document(
     file: UploadFile = File(...),
@@ -16,26 +64,40 @@ async def upload_document(
     topic: str = Form(None),
     db: AsyncSession = Depends(get_db)
 ):
-    file_id = str(uuid4())
-    file_path = f"uploads/{file_id}_{file.filename}"
+    try:
+        content_hash, file_path, file_size = await store_upload(file)
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Nội dung đã upload trước đó -> dùng lại Documents và chunks sẵn có
+    existing = await _find_by_hash(db, content_hash)
+    if existing:
+        return existing
 
     doc = Documents(
         title=file.filename,
         doc_type=file.filename.split(".")[-1],
         file_path=file_path,
+        content_hash=content_hash,
+        file_size=file_size,
         grade=grade,
         topic=topic
     )
 
     db.add(doc)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Upload song song cùng nội dung: request kia đã tạo bản ghi trước
+        await db.rollback()
+        existing = await _find_by_hash(db, content_hash)
+        if existing:
+            return existing
+        raise
     await db.refresh(doc)
     return doc
 
-@router.post("/documents/{document_id}/process")
+@router.post("/documents/{document_id}/process", status_code=202)
 async def process_uploaded_document(
     document_id: UUID,
     db: AsyncSession = Depends(get_db)
@@ -47,5 +109,58 @@ async def process_uploaded_document(
     if not document:
         return {"error": "Document not found"}
 
-    await process_document(document, db)
-    return {"status": "processed"}
+    if document.processed_at is not None:
+        return {"status": "already_processed"}
+
+    # Chạy pipeline ở background, client poll trạng thái qua /jobs/{job_id}
+    job = enqueue(document.id)
+    return {"status": job.status, "job_id": job.id}
+
+
+@router.put("/documents/{document_id}/file", status_code=202)
+async def replace_document_file(
+    document_id: UUID,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    result = await db.execute(
+        select(Documents).where(Documents.id == document_id)
+    )
+    document = result.scalar_one_or_none()
+    if not document:
+        return {"error": "Document not found"}
+    if get_active_job(document.id):
+        raise HTTPException(status_code=409, detail="Document is being processed")
+
+    try:
+        content_hash, file_path, file_size = await store_upload(file)
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    if content_hash == document.content_hash:
+        return {"status": "unchanged"}
+    if await _find_by_hash(db, content_hash):
+        raise HTTPException(status_code=409, detail="Content already uploaded as another document")
+
+    old_path = document.file_path
+    document.title = file.filename
+    document.doc_type = file.filename.split(".")[-1]
+    document.file_path = file_path
+    document.content_hash = content_hash
+    document.file_size = file_size
+    document.processed_at = None
+    await db.commit()
+
+    if old_path != file_path and os.path.exists(old_path):
+        os.remove(old_path)
+
+    # Chỉ chunk mới/đổi được embed lại, xem process_document
+    job = enqueue(document.id)
+    return {"status": job.status, "job_id": job.id}
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_ingestion_job(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
@@ -1,22 +1,50 @@
-import asyncio
+import json
+import logging
+from collections import OrderedDict
+from contextlib import aclosing
 from typing import List, Optional, AsyncIterator
 
+import anyio
 from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import StreamingResponse
 
-from core.database import get_db
+from core.database import AsyncSessionLocal, get_db
 from models.chat_message import ChatMessage
 from models.chat_session import ChatSession
 from models.user import User
-from services.chroma_service import collection, get_current_user_id
-from services.llm_service import generate_reply
+from models.user_profile import UserProfile
+from services.answer_cache import lookup_answer, store_answer
+from services.chroma_service import get_current_user_id
+from services.llm_service import generate_reply, stream_reply
 from services.mastery_service import upsert_mastery
+from services.retrieval import search
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/tutor", tags=["Tutor"])
 
+# grade_level của học sinh theo chat session: chỉ đọc UserProfile ở tin nhắn đầu
+SESSION_GRADE_CACHE_SIZE = 10000
+_session_grades: "OrderedDict[str, Optional[int]]" = OrderedDict()
+
+
+async def _session_grade(db: AsyncSession, session_id, user_id: str) -> Optional[int]:
+    key = str(session_id)
+    if key in _session_grades:
+        _session_grades.move_to_end(key)
+        return _session_grades[key]
+    result = await db.execute(
+        select(UserProfile.grade_level).where(UserProfile.user_id == user_id)
+    )
+    grade = result.scalar_one_or_none()
+    _session_grades[key] = grade
+    while len(_session_grades) > SESSION_GRADE_CACHE_SIZE:
+        _session_grades.popitem(last=False)
+    return grade
+
 
 class TutorChatRequest(BaseModel):
 
@@ -55,6 +83,8 @@ class TutorChatResponse(BaseModel):
     session_id: str
     context: List[ContextChunk]
     diagram: Optional[Diagram] = None
+    prompt_tokens: Optional[int] = None
+    cached: bool = False
 
 class ChatMessageResponse(BaseModel):
     id: str
@@ -96,20 +126,9 @@ async def tutor_chat(payload: TutorChatRequest, db: AsyncSession = Depends(get_d
         db.add(session)
         await db.flush()
 
-    query_kwargs = {
-        "query_texts": [payload.message],
-        "n_results": 3,
-        "include": ["documents", "distances"],
-    }
-    # if payload.grade is not None:
-    #     query_kwargs["where"] = {"grade": payload.grade}
-
-    query_result = collection.query(**query_kwargs)
+    grade = await _session_grade(db, session.id, user_id)
+    query_result = await search(payload.message, n_results=3, grade=grade)
     documents = query_result.get("documents", [[]])[0]
-    # if payload.grade is not None and not documents:
-    #     query_kwargs.pop("where", None)
-    #     query_result = collection.query(**query_kwargs)
-    #     documents = query_result.get("documents", [[]])[0]
 
     contexts: List[ContextChunk] = []
     ids = query_result.get("ids", [[]])[0]
@@ -133,21 +152,32 @@ async def tutor_chat(payload: TutorChatRequest, db: AsyncSession = Depends(get_d
         f"{item.role}: {item.content}" for item in history_items
     ]
 
-    try:
-        response_payload = await generate_reply(
-            payload.message,
-            context_texts,
-            history_lines,
-        )
-    except ValueError as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    # Semantic cache chỉ áp dụng cho tin nhắn đầu (reply không phụ thuộc lịch sử)
+    first_turn = not history_items
+    cached = await lookup_answer(payload.message, ids) if first_turn else None
+    if cached is not None:
+        response_payload = {"reply": cached.reply, "diagram": cached.diagram}
+    else:
+        try:
+            response_payload = await generate_reply(
+                payload.message,
+                context_texts,
+                history_lines,
+                scores=query_result.get("scores", [[]])[0],
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
 
     if isinstance(response_payload, dict):
         reply = str(response_payload.get("reply", "")).strip()
         diagram = response_payload.get("diagram")
+        prompt_tokens = response_payload.get("prompt_tokens")
     else:
         reply = str(response_payload).strip()
         diagram = None
+        prompt_tokens = None
+    if first_turn and cached is None:
+        await store_answer(payload.message, ids, reply, _validated_diagram(diagram))
 
     user_message = ChatMessage(
         session_id=session.id,
@@ -169,9 +199,36 @@ async def tutor_chat(payload: TutorChatRequest, db: AsyncSession = Depends(get_d
         session_id=str(session.id),
         context=contexts,
         diagram=diagram,
+        prompt_tokens=prompt_tokens,
+        cached=cached is not None,
     )
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _validated_diagram(diagram) -> Optional[dict]:
+    try:
+        return Diagram.model_validate(diagram).model_dump(by_alias=True, exclude_none=True)
+    except (ValidationError, TypeError):
+        return None
+
+
+async def _cached_events(cached) -> AsyncIterator[dict]:
+    # Cùng dạng event với stream_reply để _stream() không phải phân nhánh
+    yield {"type": "reply", "text": cached.reply}
+    if cached.diagram:
+        yield {"type": "diagram", "diagram": cached.diagram}
+    yield {"type": "done", "reply": cached.reply, "diagram": cached.diagram, "prompt_tokens": None}
+
+
 @router.post("/chat/stream")
 async def tutor_chat_stream(payload: TutorChatRequest, db: AsyncSession = Depends(get_db),user_id: str = Depends( get_current_user_id)):
+    """Server-Sent Events: `reply` (đoạn text mới), `diagram`, `done`, `error`.
+
+    Token được relay ngay khi model sinh ra. Tin nhắn user luôn được lưu khi stream
+    kết thúc hoặc bị hủy (client ngắt kết nối -> hủy luôn request tới LLM); tin nhắn
+    assistant chỉ được lưu khi sinh xong (đã gửi `done`).
+    """
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalar_one_or_none()
     if not user:
@@ -191,20 +248,9 @@ async def tutor_chat_stream(payload: TutorChatRequest, db: AsyncSession = Depend
         db.add(session)
         await db.flush()
 
-    query_kwargs = {
-        "query_texts": [payload.message],
-        "n_results": 3,
-        "include": ["documents", "distances"],
-    }
-    # if payload.grade is not None:
-    #     query_kwargs["where"] = {"grade": payload.grade}
-
-    query_result = collection.query(**query_kwargs)
+    grade = await _session_grade(db, session.id, user_id)
+    query_result = await search(payload.message, n_results=3, grade=grade)
     documents = query_result.get("documents", [[]])[0]
-    # if payload.grade is not None and not documents:
-    #     query_kwargs.pop("where", None)
-    #     query_result = collection.query(**query_kwargs)
-    #     documents = query_result.get("documents", [[]])[0]
 
     contexts: List[ContextChunk] = []
     ids = query_result.get("ids", [[]])[0]
@@ -225,43 +271,71 @@ async def tutor_chat_stream(payload: TutorChatRequest, db: AsyncSession = Depend
     )
     history_items = list(reversed(history_result.scalars().all()))
     history_lines = [f"{item.role}: {item.content}" for item in history_items]
+    first_turn = not history_items
+    cached = await lookup_answer(payload.message, ids) if first_turn else None
 
-    try:
-        response_payload = await generate_reply(
-            payload.message,
-            context_texts,
-            history_lines,
-        )
-    except ValueError as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
-
-    if isinstance(response_payload, dict):
-        reply = str(response_payload.get("reply", "")).strip()
-    else:
-        reply = str(response_payload).strip()
-
-    user_message = ChatMessage(
-        session_id=session.id,
-        role="user",
-        content=payload.message,
-    )
-    assistant_message = ChatMessage(
-        session_id=session.id,
-        role="assistant",
-        content=reply,
-    )
-    db.add_all([user_message, assistant_message])
-    # if payload.topic:
-    #     await upsert_mastery(db, payload.user_id, payload.topic, delta=0.01)
+    # Session phải có trong DB trước khi stream: tin nhắn được lưu bằng session DB riêng
     await db.commit()
+    session_id = session.id
 
     async def _stream() -> AsyncIterator[bytes]:
-        for chunk in reply.split():
-            yield f"{chunk} ".encode("utf-8")
-            await asyncio.sleep(0)
-
-    return StreamingResponse(_stream(), media_type="text/plain",    headers={"X-Session-Id": str(session.id)}
-)
+        final_reply = None
+        try:
+            if cached is not None:
+                events = _cached_events(cached)
+            else:
+                events = stream_reply(
+                    payload.message,
+                    context_texts,
+                    history_lines,
+                    scores=query_result.get("scores", [[]])[0],
+                )
+            async with aclosing(events):
+                async for event in events:
+                    if event["type"] == "reply":
+                        yield _sse("reply", {"text": event["text"]})
+                    elif event["type"] == "diagram":
+                        diagram = _validated_diagram(event["diagram"])
+                        if diagram is not None:
+                            yield _sse("diagram", diagram)
+                    elif event["type"] == "done":
+                        final_reply = event["reply"]
+                        if first_turn and cached is None:
+                            await store_answer(
+                                payload.message, ids, final_reply, _validated_diagram(event["diagram"])
+                            )
+                        yield _sse("done", {
+                            "session_id": str(session_id),
+                            "reply": final_reply,
+                            "context": [item.model_dump() for item in contexts],
+                            "prompt_tokens": event["prompt_tokens"],
+                            "cached": cached is not None,
+                        })
+        except Exception:
+            # Chi tiết lỗi (URL upstream, thông báo của provider) chỉ ghi log
+            logger.exception("Tutor stream failed")
+            yield _sse("error", {"detail": "Reply generation failed"})
+        finally:
+            messages = [ChatMessage(session_id=session_id, role="user", content=payload.message)]
+            # Chỉ lưu lượt assistant khi sinh xong: reply rỗng/dở dang sẽ lẫn vào lịch sử của lượt sau
+            if final_reply:
+                messages.append(ChatMessage(session_id=session_id, role="assistant", content=final_reply))
+            # Khi bị cancel, await trong finally cũng bị cancel nếu không shield
+            with anyio.CancelScope(shield=True):
+                async with AsyncSessionLocal() as message_db:
+                    message_db.add_all(messages)
+                    await message_db.commit()
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={
+            "X-Session-Id": str(session_id),
+            "Cache-Control": "no-cache",
+            # Tắt buffer của nginx để event tới client ngay
+            "X-Accel-Buffering": "no",
+        },
+    )
 
 
 @router.get("/sessions", response_model=SessionListResponse)
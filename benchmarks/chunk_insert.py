@@ -0,0 +1,106 @@
+"""So sánh tốc độ ghi DocumentChunk (chunks/sec): flush từng dòng vs bulk insert.
+
+    python -m benchmarks.chunk_insert --pdf uploads/<file>.pdf --min-chunks 2000
+    python -m benchmarks.chunk_insert --database-url postgresql+asyncpg://...
+"""
+import argparse
+import asyncio
+import glob
+import os
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base
+from models.document_chunk import DocumentChunk
+from models.documents import Documents
+from services.chunking import iter_chunks
+from services.document_loader import iter_pdf_pages
+from services.chunk_store import insert_chunk_rows
+
+
+async def per_row(db: AsyncSession, document_id, chunks) -> None:
+    for idx, piece in enumerate(chunks):
+        db.add(DocumentChunk(
+            document_id=document_id,
+            content=piece.content,
+            chunk_index=idx,
+            token_count=piece.token_count,
+            page_start=piece.page_start,
+            page_end=piece.page_end,
+        ))
+        await db.flush()
+    await db.commit()
+
+
+async def bulk(db: AsyncSession, document_id, chunks) -> None:
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "document_id": document_id,
+            "content": piece.content,
+            "chunk_index": idx,
+            "token_count": piece.token_count,
+            "page_start": piece.page_start,
+            "page_end": piece.page_end,
+        }
+        for idx, piece in enumerate(chunks)
+    ]
+    await insert_chunk_rows(db, rows)
+    await db.commit()
+
+
+async def run(database_url: str, chunks) -> None:
+    engine = create_async_engine(database_url)
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with Session() as db:
+        document = Documents(title="benchmark", doc_type="pdf", file_path="benchmark.pdf")
+        db.add(document)
+        await db.commit()
+
+        for name, write in (("per-row flush", per_row), ("bulk insert", bulk)):
+            started = time.perf_counter()
+            await write(db, document.id, chunks)
+            elapsed = time.perf_counter() - started
+            print(f"{name:<14} chunks={len(chunks):<6} {elapsed:8.3f}s  {len(chunks) / elapsed:10.1f} chunks/s")
+            await db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document.id))
+            await db.commit()
+
+        await db.delete(document)
+        await db.commit()
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdf", default=None)
+    parser.add_argument("--min-chunks", type=int, default=2000)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    path = args.pdf or next(iter(sorted(glob.glob("uploads/*.pdf"))), None)
+    if not path:
+        raise SystemExit("No PDF given and none found in uploads/")
+
+    chunks = list(iter_chunks(iter_pdf_pages(path)))
+    # Lặp lại nội dung để mô phỏng một cuốn sách lớn
+    while len(chunks) < args.min_chunks:
+        chunks = chunks + chunks
+    chunks = chunks[:args.min_chunks]
+
+    database_url = args.database_url
+    if database_url is None:
+        database_url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    print(f"{path} -> {len(chunks)} chunks, {database_url.split('://')[0]}")
+    asyncio.run(run(database_url, chunks))
+
+
+if __name__ == "__main__":
+    main()
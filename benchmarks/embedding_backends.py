@@ -0,0 +1,133 @@
+"""So sánh các EMBEDDING_BACKEND trên CPU, kết quả dạng JSON.
+
+    python -m benchmarks.embedding_backends --corpus uploads
+    python -m benchmarks.embedding_backends --backends sentence-transformers onnx-int8 --queries queries.txt
+
+Mỗi backend: sentences/sec khi embed chunk theo EMBED_BATCH_SIZE, latency p50/p95/p99
+của từng câu hỏi đơn lẻ, recall@k của top-k (cosine trên chính corpus) so với backend
+đầu tiên, và cosine trung bình giữa vector của backend với vector tham chiếu.
+Không có --queries thì lấy 12 từ đầu của các chunk làm câu hỏi.
+"""
+import os
+
+# Không đụng tới vector store thật khi benchmark
+os.environ.setdefault("CHROMA_MODE", "memory")
+os.environ.setdefault("CHROMA_COLLECTION", "benchmark")
+
+import argparse
+import glob
+import json
+import sys
+import time
+
+import numpy as np
+
+from services.chroma_service import EMBEDDING_BACKENDS, make_embedding_function
+from services.chunking import iter_chunks
+from services.document_loader import iter_pdf_pages
+from services.chunk_store import EMBED_BATCH_SIZE
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def _normalized(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def _top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+def run_backend(backend: str, texts: list[str], queries: list[str]) -> dict:
+    started = time.perf_counter()
+    ef = make_embedding_function(backend)
+    ef(["warmup"])
+    load_seconds = time.perf_counter() - started
+
+    vectors = []
+    started = time.perf_counter()
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        vectors.extend(ef(texts[start:start + EMBED_BATCH_SIZE]))
+    embed_seconds = time.perf_counter() - started
+
+    latencies = []
+    query_vectors = []
+    for query in queries:
+        started = time.perf_counter()
+        query_vectors.extend(ef([query]))
+        latencies.append(time.perf_counter() - started)
+
+    return {
+        "load_seconds": round(load_seconds, 3),
+        "sentences_per_sec": round(len(texts) / embed_seconds, 2),
+        "query_ms": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+        },
+        "_corpus": _normalized(vectors),
+        "_queries": _normalized(query_vectors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="uploads", help="Thư mục hoặc glob các file PDF")
+    parser.add_argument("--queries", default=None, help="File text, mỗi dòng một câu hỏi")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--limit", type=int, default=2000, help="Số chunk tối đa")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", default=None, help="Ghi JSON ra file thay vì stdout")
+    args = parser.parse_args()
+
+    pattern = os.path.join(args.corpus, "*.pdf") if os.path.isdir(args.corpus) else args.corpus
+    texts = []
+    for path in sorted(glob.glob(pattern)):
+        texts.extend(chunk.content for chunk in iter_chunks(iter_pdf_pages(path)))
+        if len(texts) >= args.limit:
+            break
+    texts = texts[:args.limit]
+    if not texts:
+        raise SystemExit(f"No PDF found for {args.corpus}")
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as handle:
+            queries = [line.strip() for line in handle if line.strip()]
+    else:
+        queries = [" ".join(text.split()[:12]) for text in texts[::max(1, len(texts) // 200)]]
+
+    k = min(args.k, len(texts))
+    results = {backend: run_backend(backend, texts, queries) for backend in args.backends}
+
+    vectors = {backend: (result.pop("_corpus"), result.pop("_queries")) for backend, result in results.items()}
+    reference_name = args.backends[0]
+    reference_corpus, reference_queries = vectors[reference_name]
+    reference_top = _top_k(reference_corpus, reference_queries, k)
+    for backend, result in results.items():
+        corpus, query_vectors = vectors[backend]
+        top = _top_k(corpus, query_vectors, k)
+        overlap = [len(set(mine) & set(theirs)) / k for mine, theirs in zip(top, reference_top)]
+        result[f"recall@{k}"] = round(float(np.mean(overlap)), 4)
+        result["cosine_to_reference"] = round(float(np.mean(np.sum(corpus * reference_corpus, axis=1))), 6)
+
+    payload = json.dumps({
+        "backends": results,
+        "reference": reference_name,
+        "chunks": len(texts),
+        "queries": len(queries),
+        "batch_size": EMBED_BATCH_SIZE,
+        "python": sys.version.split()[0],
+    }, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
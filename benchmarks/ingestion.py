@@ -0,0 +1,179 @@
+"""Benchmark pipeline ingest theo từng stage, kết quả dạng JSON.
+
+    python -m benchmarks.ingestion --corpus uploads --output bench_ingestion.json
+    python -m benchmarks.ingestion --database-url postgresql+asyncpg://... --skip-embed
+
+Stage: extract (iter_pdf_pages) -> chunk (iter_chunks) -> insert (insert_chunk_rows)
+-> embed (collection.upsert theo EMBED_BATCH_SIZE, Chroma in-memory riêng).
+"""
+import os
+
+# Không đụng tới vector store thật khi benchmark
+os.environ.setdefault("CHROMA_MODE", "memory")
+os.environ.setdefault("CHROMA_COLLECTION", "benchmark")
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import platform
+import resource
+import sys
+import tempfile
+import time
+import uuid
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base
+from models.documents import Documents
+from services.chunking import iter_chunks
+from services.document_loader import iter_pdf_pages
+from services.chunk_store import EMBED_BATCH_SIZE, chunk_hash, insert_chunk_rows
+
+
+def _peak_rss_mb(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    if platform.system() == "Darwin":
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+class Stage:
+    def __init__(self, unit: str):
+        self.unit = unit
+        self.count = 0
+        self.seconds = 0.0
+
+    def report(self) -> dict:
+        rate = self.count / self.seconds if self.seconds else 0.0
+        return {self.unit: self.count, "seconds": round(self.seconds, 4), f"{self.unit}_per_sec": round(rate, 2)}
+
+
+def _file_hash(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+async def run(paths, database_url: str, skip_embed: bool) -> dict:
+    stages = {
+        "extract": Stage("pages"),
+        "chunk": Stage("chunks"),
+        "insert": Stage("chunks"),
+        "embed": Stage("vectors"),
+    }
+    collection = None
+    if not skip_embed:
+        from services.chroma_service import collection
+
+    engine = create_async_engine(database_url)
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    wall_started = time.perf_counter()
+    async with Session() as db:
+        for path in paths:
+            started = time.perf_counter()
+            pages = list(iter_pdf_pages(path))
+            stages["extract"].seconds += time.perf_counter() - started
+            stages["extract"].count += len(pages)
+
+            started = time.perf_counter()
+            chunks = list(iter_chunks(pages))
+            stages["chunk"].seconds += time.perf_counter() - started
+            stages["chunk"].count += len(chunks)
+
+            document = Documents(title=os.path.basename(path), doc_type="pdf", file_path=path)
+            db.add(document)
+            await db.commit()
+            rows = [
+                {
+                    "id": uuid.uuid4(),
+                    "document_id": document.id,
+                    "content": piece.content,
+                    "content_hash": chunk_hash(piece.content),
+                    "chunk_index": idx,
+                    "token_count": piece.token_count,
+                    "page_start": piece.page_start,
+                    "page_end": piece.page_end,
+                }
+                for idx, piece in enumerate(chunks)
+            ]
+            started = time.perf_counter()
+            await insert_chunk_rows(db, rows)
+            await db.commit()
+            stages["insert"].seconds += time.perf_counter() - started
+            stages["insert"].count += len(rows)
+
+            if collection is not None:
+                started = time.perf_counter()
+                for start in range(0, len(rows), EMBED_BATCH_SIZE):
+                    batch = rows[start:start + EMBED_BATCH_SIZE]
+                    collection.upsert(
+                        ids=[str(row["id"]) for row in batch],
+                        documents=[row["content"] for row in batch],
+                        metadatas=[{"document_id": str(document.id)} for _ in batch],
+                    )
+                stages["embed"].seconds += time.perf_counter() - started
+                stages["embed"].count += len(rows)
+    wall_seconds = time.perf_counter() - wall_started
+    await engine.dispose()
+
+    report = {name: stage.report() for name, stage in stages.items()}
+    if skip_embed:
+        report.pop("embed")
+    return {
+        "stages": report,
+        "wall_seconds": round(wall_seconds, 4),
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="uploads", help="Thư mục hoặc glob các file PDF")
+    parser.add_argument("--database-url", default=None, help="Mặc định: SQLite tạm")
+    parser.add_argument("--unique", action="store_true", help="Bỏ qua file trùng nội dung")
+    parser.add_argument("--skip-embed", action="store_true")
+    parser.add_argument("--output", default=None, help="Ghi JSON ra file thay vì stdout")
+    args = parser.parse_args()
+
+    pattern = os.path.join(args.corpus, "*.pdf") if os.path.isdir(args.corpus) else args.corpus
+    paths = sorted(glob.glob(pattern))
+    if args.unique:
+        seen = {}
+        for path in paths:
+            seen.setdefault(_file_hash(path), path)
+        paths = sorted(seen.values())
+    if not paths:
+        raise SystemExit(f"No PDF found for {args.corpus}")
+
+    database_url = args.database_url
+    if database_url is None:
+        database_url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    result = asyncio.run(run(paths, database_url, args.skip_embed))
+    result.update({
+        "corpus": args.corpus,
+        "files": len(paths),
+        "database": database_url.split("://")[0],
+        "python": sys.version.split()[0],
+    })
+    payload = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
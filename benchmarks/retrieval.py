@@ -0,0 +1,168 @@
+"""Đánh giá chất lượng + latency retrieval (cùng đường search() mà tutor_chat dùng).
+
+    python -m benchmarks.retrieval --dataset eval.jsonl --k 3 --concurrency 1 8 32
+    python -m benchmarks.retrieval --dataset eval.jsonl --with-cache --output run.json
+
+Mỗi dòng của dataset là một JSON:
+    {"id": "q1", "question": "...", "expected_chunk_ids": ["..."],
+     "expected_document_ids": ["..."], "grade": 6}
+Cần ít nhất một trong expected_chunk_ids / expected_document_ids; grade tùy chọn.
+
+Báo recall@k, MRR (theo chunk và theo document) và latency p50/p95/p99 cho từng
+mức concurrency. Mặc định tắt cache embedding/kết quả để đo đường query thật.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+def load_dataset(path: str) -> list[dict]:
+    items = []
+    with open(path, encoding="utf-8") as handle:
+        for line_no, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not item.get("question"):
+                raise SystemExit(f"{path}:{line_no}: missing question")
+            if not item.get("expected_chunk_ids") and not item.get("expected_document_ids"):
+                raise SystemExit(f"{path}:{line_no}: missing expected_chunk_ids/expected_document_ids")
+            item.setdefault("id", str(line_no))
+            items.append(item)
+    return items
+
+
+def _rank_metrics(retrieved: list[str], expected: set[str]) -> tuple[float | None, float | None]:
+    if not expected:
+        return None, None
+    hits = [rank for rank, item in enumerate(retrieved, 1) if item in expected]
+    recall = len(set(retrieved) & expected) / len(expected)
+    return recall, 1.0 / hits[0] if hits else 0.0
+
+
+def _mean(values) -> float | None:
+    values = [value for value in values if value is not None]
+    return round(float(np.mean(values)), 4) if values else None
+
+
+def _latency(samples: list[float]) -> dict:
+    return {
+        "p50": round(float(np.percentile(samples, 50)) * 1000, 3),
+        "p95": round(float(np.percentile(samples, 95)) * 1000, 3),
+        "p99": round(float(np.percentile(samples, 99)) * 1000, 3),
+        "mean": round(float(np.mean(samples)) * 1000, 3),
+    }
+
+
+async def run(items: list[dict], k: int, concurrency_levels: list[int], repeat: int, lexical: bool) -> dict:
+    from services.chroma_service import collection
+    from core.database import AsyncSessionLocal
+    from services.retrieval import load_lexical_index, search
+
+    if lexical:
+        await load_lexical_index(AsyncSessionLocal)
+
+    # Chất lượng: một lượt tuần tự
+    per_query = []
+    for item in items:
+        result = await search(item["question"], n_results=k, grade=item.get("grade"))
+        chunk_ids = result["ids"][0]
+        document_of = {}
+        if chunk_ids:
+            fetched = collection.get(ids=chunk_ids, include=["metadatas"])
+            for chunk_id, metadata in zip(fetched["ids"], fetched["metadatas"]):
+                document_of[chunk_id] = (metadata or {}).get("document_id")
+        document_ids = list(dict.fromkeys(document_of.get(chunk_id) for chunk_id in chunk_ids))
+
+        chunk_recall, chunk_rr = _rank_metrics(chunk_ids, set(item.get("expected_chunk_ids") or []))
+        document_recall, document_rr = _rank_metrics(document_ids, set(item.get("expected_document_ids") or []))
+        per_query.append({
+            "id": item["id"],
+            "retrieved": chunk_ids,
+            "partition": result.get("partition"),
+            "chunk_recall": chunk_recall,
+            "chunk_rr": chunk_rr,
+            "document_recall": document_recall,
+            "document_rr": document_rr,
+        })
+
+    # Latency: mỗi mức concurrency chạy `repeat` lượt toàn bộ dataset
+    latency = {}
+    for concurrency in concurrency_levels:
+        semaphore = asyncio.Semaphore(concurrency)
+        samples = []
+
+        async def _timed(item):
+            async with semaphore:
+                started = time.perf_counter()
+                await search(item["question"], n_results=k, grade=item.get("grade"))
+                samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[_timed(item) for _ in range(repeat) for item in items])
+        wall = time.perf_counter() - started
+        latency[str(concurrency)] = {
+            "latency_ms": _latency(samples),
+            "queries": len(samples),
+            "qps": round(len(samples) / wall, 2),
+        }
+
+    return {
+        f"chunk_recall@{k}": _mean(row["chunk_recall"] for row in per_query),
+        "chunk_mrr": _mean(row["chunk_rr"] for row in per_query),
+        f"document_recall@{k}": _mean(row["document_recall"] for row in per_query),
+        "document_mrr": _mean(row["document_rr"] for row in per_query),
+        "concurrency": latency,
+        "per_query": per_query,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", required=True, help="File JSONL câu hỏi + id kỳ vọng")
+    parser.add_argument("--k", type=int, default=3, help="n_results, mặc định như tutor_chat")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=3, help="Số lượt dataset cho mỗi mức concurrency")
+    parser.add_argument("--with-cache", action="store_true", help="Giữ cache embedding/kết quả")
+    parser.add_argument("--no-lexical", action="store_true", help="Không nạp BM25 (chỉ vector)")
+    parser.add_argument("--details", action="store_true", help="Kèm kết quả từng câu hỏi")
+    parser.add_argument("--output", default=None, help="Ghi JSON ra file thay vì stdout")
+    args = parser.parse_args()
+
+    if not args.with_cache:
+        # Phải đặt trước khi import services.retrieval
+        os.environ["QUERY_EMBEDDING_CACHE_SIZE"] = "0"
+        os.environ["RETRIEVAL_CACHE_SIZE"] = "0"
+
+    items = load_dataset(args.dataset)
+    result = asyncio.run(run(items, args.k, args.concurrency, args.repeat, not args.no_lexical))
+    if not args.details:
+        result.pop("per_query")
+
+    from services.chroma_service import EMBEDDING_BACKEND, collection
+
+    result.update({
+        "dataset": args.dataset,
+        "queries": len(items),
+        "k": args.k,
+        "cache": args.with_cache,
+        "lexical": not args.no_lexical,
+        "embedding_backend": EMBEDDING_BACKEND,
+        "collection": collection.name,
+        "python": sys.version.split()[0],
+    })
+    payload = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
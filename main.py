@@ -18,8 +18,9 @@
 #         print(f"Lỗi: {e}")
 #         raise HTTPException(status_code=500, detail=str(e))
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
 from jose import jwt, JWTError
 from sqlalchemy import select
 from fastapi.middleware.cors import CORSMiddleware
@@ -31,17 +32,44 @@ from api.auth import router as auth_router
 from api.progress import router as progress_router
 from api.assignments import router as assignments_router
 from api.lessons import router as lessons_router
+from api.admin import router as retrieval_admin_router
 # from app.api.admin import router as admin_router  # learning_units
 from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+import asyncio
 import time
+import anyio
 import uuid
 
 from core.database import AsyncSessionLocal
 from models import User
+from services.context_packer import get_tokenizer
+from services.document_loader import shutdown_pdf_pools
+from services.llm_client import close_llm_client
+from services.retrieval import load_lexical_index
+from services.upload_store import UPLOAD_MAX_BYTES
+from services.vector_index import ensure_vector_index
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Vector store persistent đã được load sẵn; chỉ kiểm tra lệch so với document_chunks
+    await ensure_vector_index()
+    # Tokenizer HF có thể phải tải từ hub: nạp trong thread lúc khởi động,
+    # không để request đầu tiên chặn event loop
+    await anyio.to_thread.run_sync(get_tokenizer)
+    # BM25 nạp nền; trong lúc chờ, search() chỉ dùng vector
+    lexical_task = asyncio.create_task(load_lexical_index(AsyncSessionLocal))
+    yield
+    lexical_task.cancel()
+    await close_llm_client()
+    await anyio.to_thread.run_sync(shutdown_pdf_pools)
+
 
 app = FastAPI(
     title="Tutor AI Backend",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
 )
 EXEMPT_PATHS = {"/api/auth/register", "/api/auth/login"}
 
@@ -84,6 +112,52 @@ async def require_authentication(request: Request, call_next):
     return await call_next(request)
 
 
+class UploadSizeLimit:
+    """Giới hạn kích thước body upload tài liệu, kể cả request chunked.
+
+    Starlette đọc + spool toàn bộ multipart trước khi handler chạy, nên giới hạn
+    phải nằm ở receive: Content-Length quá lớn thì trả 413 ngay, còn lại đếm byte
+    nhận được và dừng đọc (413) khi vượt ngưỡng.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("POST", "PUT")
+            or not scope["path"].startswith("/api/admin/documents")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": "File too large"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI trả nguyên HTTPException phát sinh khi parse form
+                    raise HTTPException(status_code=413, detail="File too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# +64 KB cho phần header/boundary của multipart
+app.add_middleware(UploadSizeLimit, max_bytes=UPLOAD_MAX_BYTES + 64 * 1024)
+
+
 @app.middleware("http")
 async def add_request_metadata(request: Request, call_next):
     start_time = time.perf_counter()
@@ -115,6 +189,7 @@ app.include_router(auth_router)
 app.include_router(progress_router)
 app.include_router(assignments_router)
 app.include_router(lessons_router)
+app.include_router(retrieval_admin_router)
 # app.include_router(admin_router)
 
 # -----------------------------
@@ -0,0 +1,32 @@
+"""document_chunks content_hash
+
+Hash nội dung chunk để re-index incremental; chunk cũ được pipeline tính bù.
+
+Revision ID: 1e6b8d3f7a42
+Revises: c94f0a2d1e57
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1e6b8d3f7a42'
+down_revision: Union[str, Sequence[str], None] = 'c94f0a2d1e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('document_chunks', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_document_chunks_content_hash'), 'document_chunks', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_document_chunks_content_hash'), table_name='document_chunks')
+    op.drop_column('document_chunks', 'content_hash')
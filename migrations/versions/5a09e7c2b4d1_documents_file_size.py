@@ -0,0 +1,30 @@
+"""documents file_size
+
+Kích thước file upload (byte).
+
+Revision ID: 5a09e7c2b4d1
+Revises: 1e6b8d3f7a42
+Create Date: 2026-10-18 09:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a09e7c2b4d1'
+down_revision: Union[str, Sequence[str], None] = '1e6b8d3f7a42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('documents', sa.Column('file_size', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('documents', 'file_size')
@@ -0,0 +1,32 @@
+"""document_chunks page range
+
+Trang đầu/cuối của PDF mà chunk trải qua (NULL với DOCX và chunk cũ).
+
+Revision ID: 7d21c6e05b93
+Revises: 3b8e1f4a9c20
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d21c6e05b93'
+down_revision: Union[str, Sequence[str], None] = '3b8e1f4a9c20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('document_chunks', sa.Column('page_start', sa.Integer(), nullable=True))
+    op.add_column('document_chunks', sa.Column('page_end', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('document_chunks', 'page_end')
+    op.drop_column('document_chunks', 'page_start')
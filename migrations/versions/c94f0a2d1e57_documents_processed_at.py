@@ -0,0 +1,30 @@
+"""documents processed_at
+
+Thời điểm pipeline xử lý xong document; NULL = chưa xử lý hoặc đang dở.
+
+Revision ID: c94f0a2d1e57
+Revises: 7d21c6e05b93
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c94f0a2d1e57'
+down_revision: Union[str, Sequence[str], None] = '7d21c6e05b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('documents', sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('documents', 'processed_at')
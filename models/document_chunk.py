@@ -15,8 +15,11 @@ class DocumentChunk(Base):
         nullable=False
     )
     content = Column(Text, nullable=False)
+    content_hash = Column(String(64), index=True)
     chunk_index = Column(Integer, nullable=False)
     token_count = Column(Integer)
+    page_start = Column(Integer)
+    page_end = Column(Integer)
     created_at = Column(DateTime, server_default=func.now())
 
     document = relationship("Documents", back_populates="chunks")  # ✅ ĐÚNG
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -13,9 +13,12 @@ class Documents(Base):
     doc_type = Column(String)
     source = Column(String)
     file_path  = Column(String, nullable=False)
+    content_hash = Column(String(64), unique=True, index=True)
+    file_size = Column(BigInteger)
     grade  = Column(Integer)
     topic =Column(String)
     uploaded_at   = Column(DateTime, server_default=func.now())
+    processed_at = Column(DateTime(timezone=True))
 
     chunks = relationship(
         "DocumentChunk",
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import anyio
+import numpy as np
+
+from services.retrieval import context_fingerprint, embed_query
+
+logger = logging.getLogger(__name__)
+
+# Tắt mặc định: câu trả lời cache không còn "cá nhân hóa" theo từng lần hỏi
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "0") == "1"
+# Cosine giữa hai câu hỏi (cùng ngữ cảnh retrieve được) từ ngưỡng này coi là cùng một câu
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.9"))
+# Số tập ngữ cảnh (fingerprint) tối đa, mỗi tập giữ tối đa ANSWER_CACHE_PER_CONTEXT câu hỏi
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_PER_CONTEXT = int(os.getenv("ANSWER_CACHE_PER_CONTEXT", "8"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    vector: np.ndarray
+    reply: str
+    diagram: Optional[dict]
+    created: float
+
+
+_entries: "OrderedDict[str, List[CachedAnswer]]" = OrderedDict()
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+_stores = 0
+
+
+def _unit_vector(question: str) -> np.ndarray:
+    vector = np.asarray(embed_query(question), dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _lookup(fingerprint: str, vector: np.ndarray) -> Optional[CachedAnswer]:
+    global _hits, _misses
+    now = time.monotonic()
+    with _lock:
+        entries = _entries.get(fingerprint)
+        best, best_similarity = None, ANSWER_CACHE_SIMILARITY
+        if entries:
+            entries[:] = [entry for entry in entries if now - entry.created <= ANSWER_CACHE_TTL]
+            for entry in entries:
+                similarity = float(np.dot(entry.vector, vector))
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+            if entries:
+                _entries.move_to_end(fingerprint)
+            else:
+                del _entries[fingerprint]
+        if best is None:
+            _misses += 1
+            return None
+        _hits += 1
+    logger.info("Answer cache hit (similarity %.3f) for cached question %r", best_similarity, best.question)
+    return best
+
+
+async def lookup_answer(question: str, context_ids: Sequence[str]) -> Optional[CachedAnswer]:
+    """Tìm câu trả lời đã lưu cho câu hỏi tương tự với đúng tập chunk ngữ cảnh.
+
+    Chỉ dùng cho tin nhắn đầu session (không có lịch sử): reply phụ thuộc cả lịch sử.
+    """
+    if not ANSWER_CACHE_ENABLED or not context_ids:
+        return None
+    # Vector vừa được search() embed nên thường lấy từ cache embedding
+    vector = await anyio.to_thread.run_sync(_unit_vector, question)
+    return _lookup(context_fingerprint(context_ids), vector)
+
+
+async def store_answer(
+    question: str,
+    context_ids: Sequence[str],
+    reply: str,
+    diagram: Optional[dict],
+) -> None:
+    global _stores
+    if not ANSWER_CACHE_ENABLED or not context_ids or not reply:
+        return
+    vector = await anyio.to_thread.run_sync(_unit_vector, question)
+    entry = CachedAnswer(question, vector, reply, diagram, time.monotonic())
+    fingerprint = context_fingerprint(context_ids)
+    with _lock:
+        entries = _entries.setdefault(fingerprint, [])
+        entries.append(entry)
+        del entries[:-ANSWER_CACHE_PER_CONTEXT]
+        _entries.move_to_end(fingerprint)
+        while len(_entries) > ANSWER_CACHE_SIZE:
+            _entries.popitem(last=False)
+        _stores += 1
+
+
+def clear_answer_cache() -> int:
+    with _lock:
+        size = sum(len(entries) for entries in _entries.values())
+        _entries.clear()
+        return size
+
+
+def answer_cache_stats() -> dict:
+    with _lock:
+        lookups = _hits + _misses
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "hits": _hits,
+            "misses": _misses,
+            "stores": _stores,
+            "hit_rate": round(_hits / lookups, 4) if lookups else 0.0,
+            "contexts": len(_entries),
+            "answers": sum(len(entries) for entries in _entries.values()),
+            "max_contexts": ANSWER_CACHE_SIZE,
+            "similarity": ANSWER_CACHE_SIMILARITY,
+            "ttl": ANSWER_CACHE_TTL,
+        }
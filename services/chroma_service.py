@@ -1,18 +1,177 @@
+import os
+import threading
+import time
+from functools import cached_property
+from typing import List
+
 import chromadb
 from chromadb.utils import embedding_functions
 from fastapi import APIRouter, Depends, HTTPException,Request
-ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L6-v2"
-)
 
-chroma_client = chromadb.Client()
+# memory: chỉ dùng cho dev/test, mất index khi restart
+# persistent: lưu trên đĩa tại CHROMA_PATH (một process)
+# http: chroma server dùng chung cho mọi uvicorn worker
+CHROMA_MODE = os.getenv("CHROMA_MODE", "persistent")
+CHROMA_PATH = os.getenv("CHROMA_PATH", "chroma_data")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "documents")
+
+# sentence-transformers: PyTorch fp32 (mặc định)
+# onnx: cùng weights all-MiniLM-L6-v2 chạy bằng ONNX Runtime
+# onnx-int8: ONNX quantize động int8, nhanh hơn trên CPU, vector lệch nhẹ so với fp32
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+EMBEDDING_BACKENDS = ("sentence-transformers", "onnx", "onnx-int8")
+
+
+class QuantizedONNXMiniLM(embedding_functions.ONNXMiniLM_L6_V2):
+    """all-MiniLM-L6-v2 bản ONNX của Chroma, weights quantize int8 ở lần chạy đầu."""
+
+    @cached_property
+    def model(self):
+        folder = os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME)
+        target = os.path.join(folder, "model_int8.onnx")
+        if not os.path.exists(target):
+            # Cần package onnx; chỉ import khi dùng backend này
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            tmp_target = f"{target}.{os.getpid()}.tmp"
+            quantize_dynamic(os.path.join(folder, "model.onnx"), tmp_target, weight_type=QuantType.QInt8)
+            os.replace(tmp_target, target)
+
+        options = self.ort.SessionOptions()
+        options.log_severity_level = 3
+        options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return self.ort.InferenceSession(target, providers=["CPUExecutionProvider"], sess_options=options)
+
+
+def make_embedding_function(backend: str = EMBEDDING_BACKEND):
+    if backend == "sentence-transformers":
+        return embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+    if backend == "onnx":
+        return embedding_functions.ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+    if backend == "onnx-int8":
+        return QuantizedONNXMiniLM(preferred_providers=["CPUExecutionProvider"])
+    raise ValueError(f"Unsupported EMBEDDING_BACKEND: {backend}")
+
+
+def collection_name(backend: str = EMBEDDING_BACKEND) -> str:
+    # Chroma lưu embedding function theo collection, và vector int8 không trộn được
+    # với fp32 -> mỗi backend một collection. Collection mới rỗng nên
+    # ensure_vector_index báo stale; chạy `python -m services.vector_index` để embed lại.
+    if backend == "sentence-transformers":
+        return CHROMA_COLLECTION
+    return f"{CHROMA_COLLECTION}_{backend.replace('-', '_')}"
+
+
+ef = make_embedding_function()
+
+
+def _make_client():
+    if CHROMA_MODE == "memory":
+        return chromadb.Client()
+    if CHROMA_MODE == "http":
+        return chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    if CHROMA_MODE == "persistent":
+        return chromadb.PersistentClient(path=CHROMA_PATH)
+    raise ValueError(f"Unsupported CHROMA_MODE: {CHROMA_MODE}")
+
+
+chroma_client = _make_client()
 collection = chroma_client.get_or_create_collection(
-    name="documents",
+    name=collection_name(),
     embedding_function=ef
 )
 
+# Ngoài collection chung, mỗi grade có một collection riêng chứa cùng vector:
+# query theo grade chỉ quét partition của grade đó thay vì lọc metadata trên toàn bộ.
+_partitions: dict = {}
+_partitions_lock = threading.Lock()
+# Grade chưa có partition: nhớ trong một khoảng ngắn để query theo grade đó không
+# phải gọi get_collection (+ exception) mỗi lần; process khác tạo partition thì
+# sau tối đa chừng này giây sẽ thấy
+PARTITION_MISS_TTL = float(os.getenv("PARTITION_MISS_TTL", "30"))
+_partition_misses: dict = {}
+
+
+def partition_name(grade: int) -> str:
+    return f"{collection.name}_grade_{int(grade)}"
+
+
+def grade_partition(grade: int, create: bool = False):
+    """Collection của một grade; None nếu chưa tồn tại và create=False."""
+    grade = int(grade)
+    partition = _partitions.get(grade)
+    if partition is not None:
+        return partition
+    if not create:
+        missed_at = _partition_misses.get(grade)
+        if missed_at is not None and time.monotonic() - missed_at < PARTITION_MISS_TTL:
+            return None
+    with _partitions_lock:
+        if grade not in _partitions:
+            try:
+                if create:
+                    _partitions[grade] = chroma_client.get_or_create_collection(
+                        name=partition_name(grade), embedding_function=ef
+                    )
+                else:
+                    # Partition có thể do process khác (ingest) tạo ra
+                    _partitions[grade] = chroma_client.get_collection(
+                        name=partition_name(grade), embedding_function=ef
+                    )
+            except Exception:
+                _partition_misses[grade] = time.monotonic()
+                return None
+            _partition_misses.pop(grade, None)
+        return _partitions[grade]
+
+
+def grade_partitions() -> dict:
+    prefix = f"{collection.name}_grade_"
+    for item in chroma_client.list_collections():
+        # list_collections trả về tên hoặc Collection tùy phiên bản chromadb
+        name = getattr(item, "name", item)
+        if name.startswith(prefix) and name[len(prefix):].lstrip("-").isdigit():
+            grade = int(name[len(prefix):])
+            # Đã thấy trong danh sách -> bỏ kết quả "không có" đã nhớ
+            _partition_misses.pop(grade, None)
+            grade_partition(grade)
+    return dict(_partitions)
+
+
+def upsert_chunks(ids: List[str], texts: List[str], metadatas: List[dict]) -> None:
+    """Ghi vector vào collection chung và partition theo grade; embed một lần."""
+    embeddings = ef(texts)
+    collection.upsert(ids=ids, documents=texts, embeddings=embeddings, metadatas=metadatas)
+    by_grade: dict[int, List[int]] = {}
+    for position, metadata in enumerate(metadatas):
+        if metadata.get("grade") is not None:
+            by_grade.setdefault(int(metadata["grade"]), []).append(position)
+    for grade, positions in by_grade.items():
+        grade_partition(grade, create=True).upsert(
+            ids=[ids[position] for position in positions],
+            documents=[texts[position] for position in positions],
+            embeddings=[embeddings[position] for position in positions],
+            metadatas=[metadatas[position] for position in positions],
+        )
+
+
+def delete_chunks(ids: List[str]) -> None:
+    collection.delete(ids=ids)
+    for partition in grade_partitions().values():
+        partition.delete(ids=ids)
+
+
+def chunk_metadata(document) -> dict:
+    return {
+        "document_id": str(document.id),
+        "grade": document.grade,
+        "topic": document.topic
+    }
+
 def get_current_user_id(request: Request) -> str:
     user_id = getattr(request.state, "user_id", None)
     if not user_id:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    return user_id
\ No newline at end of file
+    return user_id
@@ -0,0 +1,22 @@
+import hashlib
+import os
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.document_chunk import DocumentChunk
+
+# Không import Chroma / core.database: benchmark DB-only dùng được với engine riêng
+CHUNK_INSERT_BATCH = int(os.getenv("CHUNK_INSERT_BATCH", "500"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+
+def chunk_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+async def insert_chunk_rows(db: AsyncSession, rows: list[dict]) -> None:
+    # id được sinh phía client nên không cần flush từng dòng; SQLAlchemy gộp
+    # executemany thành các câu INSERT ... VALUES nhiều dòng
+    for start in range(0, len(rows), CHUNK_INSERT_BATCH):
+        await db.execute(insert(DocumentChunk), rows[start:start + CHUNK_INSERT_BATCH])
@@ -1,16 +1,157 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
 import tiktoken
 
 encoder = tiktoken.get_encoding("cl100k_base")
 
-def chunk_text(text: str, max_tokens=400, overlap=50):
-    tokens = encoder.encode(text)
-    chunks = []
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+@dataclass
+class TextChunk:
+    content: str
+    token_count: int
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+
+
+def count_tokens(text: str) -> int:
+    return len(encoder.encode_ordinary(text))
 
+
+def _decode_window(tokens: List[int], start: int, end: int) -> Tuple[int, str]:
+    # Một ký tự UTF-8 có thể bị tách qua tối đa 4 token byte: lùi (hoặc tiến) end
+    # tới ranh giới giải mã trọn vẹn thay vì bỏ mất nửa ký tự
+    candidates = list(range(end, max(start, end - 4), -1))
+    candidates += range(end + 1, min(len(tokens), end + 4) + 1)
+    for cut in candidates:
+        try:
+            return cut, encoder.decode_bytes(tokens[start:cut]).decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+    return end, encoder.decode_bytes(tokens[start:end]).decode("utf-8", errors="replace")
+
+
+def _split_tokens(text: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+    # Chỉ dùng cho một "từ" không có khoảng trắng dài hơn max_tokens
+    tokens = encoder.encode_ordinary(text)
     start = 0
     while start < len(tokens):
-        end = start + max_tokens
-        chunk = encoder.decode(tokens[start:end])
-        chunks.append(chunk)
-        start = end - overlap
+        end, piece = _decode_window(tokens, start, min(start + max_tokens, len(tokens)))
+        piece = piece.strip()
+        if piece:
+            yield piece, end - start
+        start = end
+
+
+def _split_words(line: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+    words: List[str] = []
+    total = 0
+    for word in line.split():
+        size = count_tokens(" " + word)
+        if size > max_tokens:
+            if words:
+                yield " ".join(words), total
+                words, total = [], 0
+            yield from _split_tokens(word, max_tokens)
+            continue
+        if words and total + size > max_tokens:
+            yield " ".join(words), total
+            words, total = [], 0
+        words.append(word)
+        total += size
+    if words:
+        yield " ".join(words), total
+
+
+def _pieces(text: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+    # Ưu tiên giữ nguyên đoạn văn; đoạn quá dài thì tách theo dòng, rồi theo từ
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        size = count_tokens(paragraph)
+        if size <= max_tokens:
+            yield paragraph, size
+            continue
+        for line in paragraph.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            size = count_tokens(line)
+            if size <= max_tokens:
+                yield line, size
+            else:
+                yield from _split_words(line, max_tokens)
+
+
+def iter_chunks(
+    pages: Iterable[Tuple[Optional[int], str]],
+    max_tokens: int = 400,
+    overlap: int = 50,
+) -> Iterator[TextChunk]:
+    """Chia luồng (page_number, text) thành các chunk tối đa max_tokens.
+
+    Chỉ giữ một trang và chunk đang gom trong bộ nhớ. Ranh giới chunk rơi vào
+    cuối đoạn văn/dòng; phần overlap là các đoạn cuối của chunk trước.
+    """
+    buffer: List[Tuple[str, int, Optional[int]]] = []
+    total = 0
+    has_new = False
+
+    def emit() -> TextChunk:
+        content = "\n".join(text for text, _, _ in buffer)
+        return TextChunk(
+            content=content,
+            token_count=count_tokens(content),
+            page_start=buffer[0][2],
+            page_end=buffer[-1][2],
+        )
+
+    def tail() -> List[Tuple[str, int, Optional[int]]]:
+        if overlap <= 0:
+            return []
+        # Không mang nguyên đoạn đầu tiên sang, tránh lặp lại cả chunk ngắn
+        carried: List[Tuple[str, int, Optional[int]]] = []
+        size = 0
+        for item in reversed(buffer[1:]):
+            if size + item[1] > overlap:
+                break
+            carried.insert(0, item)
+            size += item[1]
+        if carried:
+            return carried
+        # Đoạn cuối dài hơn overlap: lấy các từ cuối, bắt đầu tại khoảng trắng
+        text, _, page = buffer[-1]
+        words = text.split()
+        kept = 0
+        size = 0
+        for word in reversed(words[1:]):
+            word_size = count_tokens(" " + word)
+            if size + word_size > overlap:
+                break
+            kept += 1
+            size += word_size
+        if not kept:
+            return []
+        piece = " ".join(words[-kept:])
+        return [(piece, count_tokens(piece), page)]
+
+    for page_number, page_text in pages:
+        for piece, size in _pieces(page_text or "", max_tokens):
+            # +1 cho ký tự xuống dòng nối giữa các đoạn
+            if has_new and total + size + 1 > max_tokens:
+                yield emit()
+                buffer = tail()
+                total = sum(item[1] + 1 for item in buffer)
+                has_new = False
+                if total + size + 1 > max_tokens:
+                    buffer, total = [], 0
+            buffer.append((piece, size, page_number))
+            total += size + 1
+            has_new = True
 
-    return chunks
+    if has_new:
+        yield emit()
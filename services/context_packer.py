@@ -0,0 +1,108 @@
+import logging
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence
+
+from services.chunking import encoder
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer HF của model đang serve (qwen2.5:7b trên Ollama); không tải được thì dùng cl100k_base
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "Qwen/Qwen2.5-7B-Instruct")
+# Ngân sách token cho ngữ cảnh + lịch sử (không tính phần hướng dẫn cố định và câu hỏi)
+LLM_CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "1500"))
+LLM_HISTORY_TOKEN_BUDGET = int(os.getenv("LLM_HISTORY_TOKEN_BUDGET", "400"))
+# Phần còn lại nhỏ hơn mức này thì bỏ hẳn chunk thay vì cắt cụt
+MIN_TRUNCATED_TOKENS = 48
+
+
+@dataclass
+class Tokenizer:
+    name: str
+    encode: Callable[[str], List[int]]
+    decode: Callable[[List[int]], str]
+
+    def count(self, text: str) -> int:
+        return len(self.encode(text))
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> Tokenizer:
+    """Có thể tải tokenizer từ HF hub: main.lifespan gọi trước trong thread."""
+    try:
+        from transformers import AutoTokenizer
+
+        hf = AutoTokenizer.from_pretrained(LLM_TOKENIZER)
+        return Tokenizer(
+            name=LLM_TOKENIZER,
+            encode=lambda text: hf.encode(text, add_special_tokens=False),
+            decode=lambda tokens: hf.decode(tokens),
+        )
+    except Exception:
+        logger.warning("Could not load tokenizer %s, counting with cl100k_base", LLM_TOKENIZER)
+        return Tokenizer(
+            name="cl100k_base",
+            encode=encoder.encode_ordinary,
+            decode=lambda tokens: encoder.decode_bytes(tokens).decode("utf-8", errors="ignore"),
+        )
+
+
+@dataclass
+class PackedContext:
+    contexts: List[str] = field(default_factory=list)
+    history: List[str] = field(default_factory=list)
+    tokens: int = 0
+    dropped_contexts: int = 0
+    truncated_contexts: int = 0
+    dropped_history: int = 0
+
+
+def pack_context(
+    contexts: Sequence[str],
+    history: Sequence[str] = (),
+    scores: Optional[Sequence[float]] = None,
+    budget: int = LLM_CONTEXT_TOKEN_BUDGET,
+    history_budget: int = LLM_HISTORY_TOKEN_BUDGET,
+) -> PackedContext:
+    """Xếp ngữ cảnh + lịch sử vào ngân sách token.
+
+    Lịch sử lấy từ dòng mới nhất ngược về, tối đa history_budget; phần còn lại của
+    budget dành cho chunk theo score giảm dần (không có score thì giữ thứ tự truyền vào).
+    Chunk không vừa bị cắt theo token nếu còn >= MIN_TRUNCATED_TOKENS, không thì bỏ.
+    Kết quả giữ thứ tự gốc: chunk theo độ liên quan, lịch sử theo thời gian.
+    """
+    tokenizer = get_tokenizer()
+    packed = PackedContext()
+
+    history_used = 0
+    kept_history: List[str] = []
+    for line in reversed(history):
+        cost = tokenizer.count(line) + 1
+        if history_used + cost > min(history_budget, budget):
+            break
+        kept_history.append(line)
+        history_used += cost
+    packed.history = list(reversed(kept_history))
+    packed.dropped_history = len(history) - len(kept_history)
+
+    remaining = budget - history_used
+    order = range(len(contexts))
+    if scores is not None:
+        order = sorted(order, key=lambda position: scores[position], reverse=True)
+    for position in order:
+        tokens = tokenizer.encode(contexts[position])
+        # +2 cho "\n\n" nối giữa các chunk
+        cost = len(tokens) + 2
+        if cost <= remaining:
+            packed.contexts.append(contexts[position])
+            remaining -= cost
+        elif remaining - 2 >= MIN_TRUNCATED_TOKENS:
+            packed.contexts.append(tokenizer.decode(tokens[:remaining - 2]).strip())
+            packed.truncated_contexts += 1
+            remaining = 0
+        else:
+            packed.dropped_contexts += 1
+
+    packed.tokens = budget - remaining
+    return packed
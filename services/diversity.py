@@ -0,0 +1,63 @@
+import hashlib
+import os
+import re
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# Cosine giữa hai chunk từ ngưỡng này coi là trùng (cùng đoạn của PDF ingest nhiều lần)
+NEAR_DUPLICATE_SIMILARITY = float(os.getenv("NEAR_DUPLICATE_SIMILARITY", "0.95"))
+# 1.0 = chỉ xét độ liên quan, 0.0 = chỉ xét độ khác biệt
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+
+def content_key(text: str) -> str:
+    normalized = re.sub(r"\s+", " ", text.strip().lower())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def select_diverse(
+    texts: Sequence[str],
+    embeddings: Sequence[Optional[Sequence[float]]],
+    relevance: Sequence[float],
+    k: int,
+    mmr_lambda: float = MMR_LAMBDA,
+    threshold: float = NEAR_DUPLICATE_SIMILARITY,
+) -> List[int]:
+    """Chọn tối đa k vị trí: bỏ bản trùng nội dung, rồi chọn theo MMR.
+
+    Ứng viên phải xếp theo relevance giảm dần. Bản trùng y hệt (sau khi chuẩn hóa
+    khoảng trắng/hoa thường) bị loại theo hash; bản gần trùng (cosine >= threshold
+    với một chunk đã chọn) bị loại theo vector. Thiếu vector thì chỉ dedupe theo hash.
+    """
+    seen = set()
+    unique = []
+    for position, text in enumerate(texts):
+        key = content_key(text)
+        if key not in seen:
+            seen.add(key)
+            unique.append(position)
+    if not unique:
+        return []
+    if any(embeddings[position] is None for position in unique):
+        return unique[:k]
+
+    vectors = np.asarray([embeddings[position] for position in unique], dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors @ vectors.T
+
+    scores = np.asarray([relevance[position] for position in unique], dtype=np.float32)
+    span = scores.max() - scores.min()
+    scores = (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+
+    selected: List[int] = []
+    available = np.ones(len(unique), dtype=bool)
+    max_similarity = np.zeros(len(unique), dtype=np.float32)
+    while len(selected) < k and available.any():
+        mmr = scores if not selected else mmr_lambda * scores - (1.0 - mmr_lambda) * max_similarity
+        best = int(np.argmax(np.where(available, mmr, -np.inf)))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+        available &= max_similarity < threshold
+    return [unique[index] for index in selected]
@@ -1,8 +1,87 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
 from pypdf import PdfReader
 from docx import Document
-def load_pdf(path: str) -> str:
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_SHARD = int(os.getenv("PDF_PAGES_PER_SHARD", "8"))
+
+_pools: dict[int, ProcessPoolExecutor] = {}
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    # Pool dùng chung cho cả process; "spawn" để không fork event loop/thread của uvicorn
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _pools[workers] = pool
+    return pool
+
+
+def shutdown_pdf_pools() -> None:
+    # Gọi khi app tắt: dừng các worker spawn thay vì để atexit tự dọn
+    while _pools:
+        _, pool = _pools.popitem()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _extract_page_range(path: str, start: int, end: int) -> List[str]:
     reader = PdfReader(path)
-    return "\n".join(page.extract_text() or "" for page in reader.pages)
+    return [reader.pages[index].extract_text() or "" for index in range(start, end)]
+
+
+def iter_pdf_pages(
+    path: str,
+    workers: int | None = None,
+    pages_per_shard: int | None = None,
+) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) theo đúng thứ tự trang, page_number bắt đầu từ 1.
+
+    Các dải trang được chia cho process pool; chỉ giữ tối đa 2 * workers shard
+    đang chạy để trang đầu tiên được trả về trước khi cả file parse xong.
+    """
+    workers = workers or PDF_WORKERS
+    pages_per_shard = pages_per_shard or PDF_PAGES_PER_SHARD
+    reader = PdfReader(path)
+    page_count = len(reader.pages)
+
+    if workers <= 1 or page_count <= pages_per_shard:
+        for index, page in enumerate(reader.pages):
+            yield index + 1, page.extract_text() or ""
+        return
+
+    shards = deque(
+        (start, min(start + pages_per_shard, page_count))
+        for start in range(0, page_count, pages_per_shard)
+    )
+    pool = _get_pool(workers)
+    in_flight = deque()
+    try:
+        while shards or in_flight:
+            while shards and len(in_flight) < workers * 2:
+                start, end = shards.popleft()
+                in_flight.append((start, pool.submit(_extract_page_range, path, start, end)))
+            start, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+
+
+def load_pdf_pages(path: str) -> List[str]:
+    return [text for _, text in iter_pdf_pages(path)]
+
+
+def load_pdf(path: str) -> str:
+    return "\n".join(load_pdf_pages(path))
 
 
 def load_docx(path: str) -> str:
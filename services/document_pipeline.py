@@ -1,50 +1,223 @@
+import asyncio
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import anyio
+from sqlalchemy import delete, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from models.chunk_embedding import ChunkEmbedding
 from models.document_chunk import DocumentChunk
-from services.chroma_service import collection
-from services.chunking import chunk_text
-from services.document_loader import load_pdf, load_docx
+from services.chroma_service import chunk_metadata, delete_chunks, upsert_chunks
+from services.chunk_store import CHUNK_INSERT_BATCH, EMBED_BATCH_SIZE, chunk_hash, insert_chunk_rows
+from services.chunking import iter_chunks
+from services.document_loader import iter_pdf_pages, load_docx
+from services.lexical_index import lexical_index
+from services.retrieval import bump_collection_version
 import os
 
-async def process_document(document, db: AsyncSession):
+# Số batch tối đa chờ embed; chunker dừng lại khi hàng đợi đầy
+EMBED_QUEUE_BATCHES = int(os.getenv("EMBED_QUEUE_BATCHES", "2"))
+
+
+@dataclass
+class IngestionProgress:
+    pages_parsed: int = 0
+    chunks_written: int = 0
+    chunks_embedded: int = 0
+    chunks_kept: int = 0
+    chunks_deleted: int = 0
+
+
+async def _iterate_in_thread(iterator):
+    # Lấy từng phần tử của iterator blocking trong worker thread
+    done = object()
+    while True:
+        item = await anyio.to_thread.run_sync(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def _write_batch(db: AsyncSession, document, rows: list[dict], progress: IngestionProgress, *, new_rows: bool):
+    if new_rows:
+        # Commit chunk trước khi embed: vector trong Chroma luôn trỏ tới dòng đã có.
+        # Embed lỗi thì lần chạy sau giữ chunk (trùng hash) và _embed_missing embed bù
+        await insert_chunk_rows(db, rows)
+        await db.commit()
+        progress.chunks_written += len(rows)
+
+    ids = [str(row["id"]) for row in rows]
+    texts = [row["content"] for row in rows]
+    metadatas = [chunk_metadata(document) for _ in rows]
+
+    # upsert để embed lại một batch (vd. commit ChunkEmbedding lỗi) không sinh vector trùng
+    await anyio.to_thread.run_sync(upsert_chunks, ids, texts, metadatas)
+    bump_collection_version()
+    await db.execute(
+        insert(ChunkEmbedding),
+        [{"chunk_id": row["id"], "embedding_id": str(row["id"])} for row in rows],
+    )
+    await db.commit()
+    items = [(chunk_id, text, document.grade) for chunk_id, text in zip(ids, texts)]
+    await anyio.to_thread.run_sync(lexical_index.add_many, items)
+    progress.chunks_embedded += len(rows)
+
+
+async def _embed_missing(db: AsyncSession, document, progress: IngestionProgress) -> None:
+    # Chunk đã lưu nhưng chưa có vector (pipeline cũ, hoặc lần chạy trước lỗi lúc embed)
+    result = await db.execute(
+        select(DocumentChunk.id, DocumentChunk.content)
+        .outerjoin(ChunkEmbedding, ChunkEmbedding.chunk_id == DocumentChunk.id)
+        .where(DocumentChunk.document_id == document.id, ChunkEmbedding.id.is_(None))
+        .order_by(DocumentChunk.chunk_index)
+    )
+    pending = [{"id": chunk_id, "content": content} for chunk_id, content in result.all()]
+    for start in range(0, len(pending), EMBED_BATCH_SIZE):
+        await _write_batch(db, document, pending[start:start + EMBED_BATCH_SIZE], progress, new_rows=False)
+
+
+async def _load_chunk_hashes(db: AsyncSession, document) -> dict[str, list]:
+    # Chunk cũ chưa có content_hash -> tính bù một lần
+    result = await db.execute(
+        select(DocumentChunk.id, DocumentChunk.content).where(
+            DocumentChunk.document_id == document.id,
+            DocumentChunk.content_hash.is_(None),
+        )
+    )
+    backfill = [{"id": chunk_id, "content_hash": chunk_hash(content)} for chunk_id, content in result.all()]
+    if backfill:
+        await db.execute(update(DocumentChunk), backfill)
+        await db.commit()
+
+    result = await db.execute(
+        select(
+            DocumentChunk.content_hash,
+            DocumentChunk.id,
+            DocumentChunk.chunk_index,
+            DocumentChunk.page_start,
+            DocumentChunk.page_end,
+        )
+        .where(DocumentChunk.document_id == document.id)
+        .order_by(DocumentChunk.chunk_index)
+    )
+    existing: dict[str, list] = {}
+    for content_hash, *row in result.all():
+        existing.setdefault(content_hash, []).append(tuple(row))
+    return existing
+
+
+async def _delete_chunks(db: AsyncSession, chunk_ids: list) -> None:
+    for start in range(0, len(chunk_ids), CHUNK_INSERT_BATCH):
+        batch = chunk_ids[start:start + CHUNK_INSERT_BATCH]
+        await db.execute(delete(ChunkEmbedding).where(ChunkEmbedding.chunk_id.in_(batch)))
+        await db.execute(delete(DocumentChunk).where(DocumentChunk.id.in_(batch)))
+    await db.commit()
+
+    ids = [str(chunk_id) for chunk_id in chunk_ids]
+    for start in range(0, len(ids), CHUNK_INSERT_BATCH):
+        batch = ids[start:start + CHUNK_INSERT_BATCH]
+        await anyio.to_thread.run_sync(delete_chunks, batch)
+    lexical_index.remove(ids)
+    bump_collection_version()
+
+
+async def process_document(document, db: AsyncSession, progress: IngestionProgress | None = None):
+    """Đồng bộ chunks của document với nội dung file hiện tại.
+
+    Chunk mới được so theo sha256 nội dung với các chunk đã lưu: chunk trùng
+    được giữ nguyên (kể cả vector), chỉ chunk mới/đổi được insert + embed,
+    chunk không còn xuất hiện bị xóa khỏi Postgres và Chroma. Cũng nhờ vậy
+    một lần chạy bị ngắt sẽ tiếp tục từ batch cuối đã commit.
+    """
+    if progress is None:
+        progress = IngestionProgress()
+
     path = document.file_path
     ext = os.path.splitext(path)[-1].lower()
 
+    # Parse/tokenize/embed đều là CPU-bound -> chạy trong thread, không chặn event loop
     if ext == ".pdf":
-        text = load_pdf(path)
+        pages = iter_pdf_pages(path)
     elif ext in [".doc", ".docx"]:
-        text = load_docx(path)
+        text = await anyio.to_thread.run_sync(load_docx, path)
+        pages = [(None, text)]
     else:
         raise ValueError("Unsupported file type")
 
-    chunks = chunk_text(text)
+    existing = await _load_chunk_hashes(db, document)
 
-    chroma_ids = []
-    chroma_texts = []
-    metadatas = []
+    def _counted(pages):
+        for page in pages:
+            progress.pages_parsed += 1
+            yield page
 
-    for idx, content in enumerate(chunks):
-        chunk = DocumentChunk(
-            document_id=document.id,
-            content=content,
-            chunk_index=idx,
-            token_count=len(content.split())
-        )
-        db.add(chunk)
-        await db.flush()  # lấy chunk.id
+    queue: asyncio.Queue = asyncio.Queue(maxsize=EMBED_QUEUE_BATCHES)
 
-        chroma_ids.append(str(chunk.id))
-        chroma_texts.append(content)
-        metadatas.append({
-            "document_id": str(document.id),
-            "grade": document.grade,
-            "topic": document.topic
-        })
+    async def _produce():
+        batch = []
+        moved = []
+        idx = 0
+        try:
+            async for piece in _iterate_in_thread(iter_chunks(_counted(pages))):
+                content_hash = chunk_hash(piece.content)
+                matches = existing.get(content_hash)
+                if matches:
+                    chunk_id, old_index, old_start, old_end = matches.pop(0)
+                    if (old_index, old_start, old_end) != (idx, piece.page_start, piece.page_end):
+                        moved.append({
+                            "id": chunk_id,
+                            "chunk_index": idx,
+                            "page_start": piece.page_start,
+                            "page_end": piece.page_end,
+                        })
+                    progress.chunks_kept += 1
+                else:
+                    batch.append({
+                        "id": uuid.uuid4(),
+                        "document_id": document.id,
+                        "content": piece.content,
+                        "content_hash": content_hash,
+                        "chunk_index": idx,
+                        "token_count": piece.token_count,
+                        "page_start": piece.page_start,
+                        "page_end": piece.page_end,
+                    })
+                idx += 1
+                if len(batch) >= EMBED_BATCH_SIZE:
+                    await queue.put((batch, moved))
+                    batch, moved = [], []
+            if batch or moved:
+                await queue.put((batch, moved))
+        except Exception:
+            await queue.put(None)
+            raise
+        await queue.put(None)
 
-    await db.commit()
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            batch, moved = item
+            if moved:
+                await db.execute(update(DocumentChunk), moved)
+            if batch:
+                await _write_batch(db, document, batch, progress, new_rows=True)
+            else:
+                await db.commit()
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
 
-    # Push vào Chroma
-    collection.add(
-        ids=chroma_ids,
-        documents=chroma_texts,
-        metadatas=metadatas
-    )
+    vanished = [row[0] for rows in existing.values() for row in rows]
+    if vanished:
+        await _delete_chunks(db, vanished)
+        progress.chunks_deleted = len(vanished)
+
+    await _embed_missing(db, document, progress)
+
+    document.processed_at = datetime.now(timezone.utc)
+    await db.commit()
@@ -2,8 +2,10 @@ import json
 import os
 import re
 
-import anyio
-from openai import OpenAI
+from services.llm_client import chat_completion
+
+# Trước đây chỉ chấm bằng LLM khi có OPENAI_API_KEY; giữ nguyên mặc định đó
+GRADING_USE_LLM = os.getenv("GRADING_USE_LLM", "1" if os.getenv("OPENAI_API_KEY") else "0") == "1"
 
 
 def _normalize_text(text: str) -> str:
@@ -43,23 +45,11 @@ async def grade_answer(
     if not answer_key:
         return 0.0, "Chưa có đáp án để chấm tự động."
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    if not GRADING_USE_LLM:
         return _heuristic_grade(student_answer, answer_key)
 
-    client = OpenAI(api_key=api_key)
-    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
     prompt = _build_grade_prompt(question_text, student_answer, answer_key)
-
-    def _call():
-        response = client.chat.completions.create(
-            model="qwen2.5:7b",
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0,
-        )
-        return response.choices[0].message.content
-
-    raw = await anyio.to_thread.run_sync(_call)
+    raw = await chat_completion([{"role": "system", "content": prompt}], temperature=0)
     try:
         data = json.loads(raw)
         score = float(data.get("score", 0.0))
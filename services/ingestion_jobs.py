@@ -0,0 +1,129 @@
+import asyncio
+import os
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from core.database import AsyncSessionLocal
+from models.documents import Documents
+from services.document_pipeline import IngestionProgress, process_document
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "2"))
+INGEST_RETRY_BACKOFF = float(os.getenv("INGEST_RETRY_BACKOFF", "2.0"))
+MAX_TRACKED_JOBS = 1000
+
+ACTIVE_STATUSES = {"queued", "running", "retrying"}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class IngestionJob:
+    id: str
+    document_id: str
+    status: str = "queued"
+    progress: IngestionProgress = field(default_factory=IngestionProgress)
+    attempts: int = 0
+    error: str | None = None
+    created_at: datetime = field(default_factory=_now)
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+
+_jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+_queue: asyncio.Queue | None = None
+_workers: list[asyncio.Task] = []
+
+
+def _ensure_workers() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+    alive = [task for task in _workers if not task.done()]
+    _workers[:] = alive
+    while len(_workers) < INGEST_WORKERS:
+        _workers.append(asyncio.create_task(_worker(_queue)))
+    return _queue
+
+
+def _forget_old_jobs() -> None:
+    # Giữ lịch sử job có giới hạn, chỉ bỏ các job đã kết thúc
+    while len(_jobs) > MAX_TRACKED_JOBS:
+        for job_id, job in _jobs.items():
+            if job.status not in ACTIVE_STATUSES:
+                del _jobs[job_id]
+                break
+        else:
+            return
+
+
+def get_active_job(document_id) -> IngestionJob | None:
+    document_id = str(document_id)
+    for job in _jobs.values():
+        if job.document_id == document_id and job.status in ACTIVE_STATUSES:
+            return job
+    return None
+
+
+def enqueue(document_id) -> IngestionJob:
+    active = get_active_job(document_id)
+    if active is not None:
+        return active
+
+    document_id = str(document_id)
+    job = IngestionJob(id=str(uuid.uuid4()), document_id=document_id)
+    _jobs[job.id] = job
+    _forget_old_jobs()
+    _ensure_workers().put_nowait(job.id)
+    return job
+
+
+def get_job(job_id: str) -> IngestionJob | None:
+    return _jobs.get(job_id)
+
+
+async def _worker(queue: asyncio.Queue) -> None:
+    while True:
+        job_id = await queue.get()
+        try:
+            job = _jobs.get(job_id)
+            if job is not None:
+                await _run(job)
+        finally:
+            queue.task_done()
+
+
+async def _run(job: IngestionJob) -> None:
+    job.started_at = _now()
+    while True:
+        job.attempts += 1
+        job.status = "running"
+        job.progress = IngestionProgress()
+        try:
+            async with AsyncSessionLocal() as db:
+                document = await db.get(Documents, uuid.UUID(job.document_id))
+                if document is None:
+                    job.status = "failed"
+                    job.error = "Document not found"
+                    break
+                await process_document(document, db, progress=job.progress)
+            job.status = "succeeded"
+            job.error = None
+            break
+        except ValueError as exc:
+            # Lỗi dữ liệu (vd. định dạng file không hỗ trợ): retry cũng vô ích
+            job.status = "failed"
+            job.error = str(exc)
+            break
+        except Exception as exc:
+            job.error = str(exc)
+            if job.attempts > INGEST_MAX_RETRIES:
+                job.status = "failed"
+                break
+            job.status = "retrying"
+            await asyncio.sleep(INGEST_RETRY_BACKOFF * 2 ** (job.attempts - 1))
+    job.finished_at = _now()
@@ -0,0 +1,201 @@
+import logging
+import math
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import anyio
+import numpy as np
+from sqlalchemy import select
+
+from models.document_chunk import DocumentChunk
+from models.documents import Documents
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Dọn các doc đã xóa khi chúng chiếm quá tỉ lệ này
+COMPACT_DEAD_RATIO = 0.3
+NO_GRADE = -1
+
+_WORD = re.compile(r"\w+")
+
+
+def _fold(term: str) -> str:
+    # "phân số" -> "phan so": học sinh hay gõ không dấu
+    stripped = "".join(
+        char for char in unicodedata.normalize("NFD", term)
+        if unicodedata.category(char) != "Mn"
+    )
+    return stripped.replace("đ", "d")
+
+
+def tokenize(text: str) -> List[str]:
+    """Âm tiết + cặp âm tiết liền kề, kèm bản bỏ dấu (tiền tố "~").
+
+    Tiếng Việt viết tách âm tiết nên bigram giữ được từ ghép như "phân_số",
+    "ước_chung"; bản bỏ dấu cho phép khớp câu hỏi gõ không dấu.
+    """
+    syllables = _WORD.findall(unicodedata.normalize("NFC", text).lower())
+    terms = syllables + [f"{first}_{second}" for first, second in zip(syllables, syllables[1:])]
+    return terms + [f"~{_fold(term)}" for term in terms]
+
+
+class LexicalIndex:
+    """Inverted index BM25 trong bộ nhớ, postings lưu bằng array (int32/float32)."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        self._reset()
+
+    def _reset(self) -> None:
+        self._term_ids: dict[str, int] = {}
+        self._postings_docs: List[array] = []
+        self._postings_tf: List[array] = []
+        self._doc_ids: List[str] = []
+        self._doc_pos: dict[str, int] = {}
+        self._doc_len = array("f")
+        self._doc_grade = array("i")
+        self._live = bytearray()
+        self._live_count = 0
+        self._total_len = 0.0
+
+    def __len__(self) -> int:
+        return self._live_count
+
+    def add_many(self, items: Iterable[Tuple[str, str, Optional[int]]]) -> None:
+        with self._lock:
+            for chunk_id, text, grade in items:
+                self._add(chunk_id, text, grade)
+
+    def _add(self, chunk_id: str, text: str, grade: Optional[int]) -> None:
+        if chunk_id in self._doc_pos:
+            self._remove(chunk_id)
+        ordinal = len(self._doc_ids)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                term_id = len(self._postings_docs)
+                self._term_ids[term] = term_id
+                self._postings_docs.append(array("i"))
+                self._postings_tf.append(array("f"))
+            self._postings_docs[term_id].append(ordinal)
+            self._postings_tf[term_id].append(tf)
+
+        length = float(sum(counts.values()))
+        self._doc_ids.append(chunk_id)
+        self._doc_pos[chunk_id] = ordinal
+        self._doc_len.append(length)
+        self._doc_grade.append(NO_GRADE if grade is None else int(grade))
+        self._live.append(1)
+        self._live_count += 1
+        self._total_len += length
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._remove(chunk_id)
+            dead = len(self._doc_ids) - self._live_count
+            if dead > 1000 and dead > COMPACT_DEAD_RATIO * len(self._doc_ids):
+                self._compact()
+
+    def _remove(self, chunk_id: str) -> None:
+        ordinal = self._doc_pos.pop(chunk_id, None)
+        if ordinal is None:
+            return
+        self._live[ordinal] = 0
+        self._live_count -= 1
+        self._total_len -= self._doc_len[ordinal]
+
+    def _compact(self) -> None:
+        live = np.frombuffer(self._live, dtype=np.uint8).astype(bool)
+        remap = np.cumsum(live, dtype=np.int64) - 1
+        for term_id in range(len(self._postings_docs)):
+            docs = np.frombuffer(self._postings_docs[term_id], dtype=np.int32)
+            keep = live[docs]
+            new_docs = remap[docs[keep]].astype(np.int32)
+            new_tf = np.frombuffer(self._postings_tf[term_id], dtype=np.float32)[keep]
+            self._postings_docs[term_id] = array("i", new_docs.tobytes())
+            self._postings_tf[term_id] = array("f", new_tf.tobytes())
+
+        self._doc_ids = [chunk_id for chunk_id, alive in zip(self._doc_ids, live) if alive]
+        self._doc_pos = {chunk_id: ordinal for ordinal, chunk_id in enumerate(self._doc_ids)}
+        self._doc_len = array("f", np.frombuffer(self._doc_len, dtype=np.float32)[live].tobytes())
+        self._doc_grade = array("i", np.frombuffer(self._doc_grade, dtype=np.int32)[live].tobytes())
+        self._live = bytearray(b"\x01" * len(self._doc_ids))
+
+    def search(self, query: str, k: int, grade: Optional[int] = None) -> List[Tuple[str, float]]:
+        with self._lock:
+            if not self._live_count:
+                return []
+            term_ids = {self._term_ids.get(term) for term in tokenize(query)}
+            term_ids.discard(None)
+            if not term_ids:
+                return []
+
+            total = len(self._doc_ids)
+            avg_len = self._total_len / self._live_count or 1.0
+            doc_len = np.frombuffer(self._doc_len, dtype=np.float32)
+            scores = np.zeros(total, dtype=np.float32)
+            for term_id in term_ids:
+                docs = np.frombuffer(self._postings_docs[term_id], dtype=np.int32)
+                tf = np.frombuffer(self._postings_tf[term_id], dtype=np.float32)
+                df = len(docs)
+                idf = math.log(1.0 + (self._live_count - df + 0.5) / (df + 0.5))
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[docs] / avg_len)
+                scores[docs] += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+            scores *= np.frombuffer(self._live, dtype=np.uint8)
+            if grade is not None:
+                scores *= np.frombuffer(self._doc_grade, dtype=np.int32) == int(grade)
+
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+            return [(self._doc_ids[ordinal], float(scores[ordinal])) for ordinal in ranked]
+
+
+lexical_index = LexicalIndex()
+
+LOAD_BATCH_SIZE = 2000
+
+
+async def build_lexical_index(session_factory: Callable) -> bool:
+    """Nạp index từ document_chunks (keyset theo id); chạy nền lúc khởi động.
+
+    session_factory: vd. core.database.AsyncSessionLocal (module này không tự tạo engine).
+    Trả về True nếu nạp xong.
+    """
+    try:
+        last_id = None
+        loaded = 0
+        async with session_factory() as db:
+            while True:
+                stmt = (
+                    select(DocumentChunk.id, DocumentChunk.content, Documents.grade)
+                    .join(Documents, Documents.id == DocumentChunk.document_id)
+                    .order_by(DocumentChunk.id)
+                    .limit(LOAD_BATCH_SIZE)
+                )
+                if last_id is not None:
+                    stmt = stmt.where(DocumentChunk.id > last_id)
+                rows = (await db.execute(stmt)).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                items = [(str(chunk_id), content, grade) for chunk_id, content, grade in rows]
+                await anyio.to_thread.run_sync(lexical_index.add_many, items)
+                loaded += len(items)
+        lexical_index.ready = True
+        logger.info("Lexical index loaded: %s chunks", loaded)
+        return True
+    except Exception:
+        logger.exception("Lexical index build failed")
+        return False
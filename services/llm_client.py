@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional
+
+import anyio
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+logger = logging.getLogger(__name__)
+
+# Endpoint OpenAI-compatible (mặc định Ollama local)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://localhost:11434/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "qwen2.5:7b")
+# Ollama không kiểm tra key nhưng SDK bắt buộc phải có giá trị
+LLM_API_KEY = os.getenv("LLM_API_KEY", "ollama")
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+# Timeout đọc: khoảng chờ tối đa giữa hai lần nhận dữ liệu (prefill của prompt dài có thể lâu)
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", "16"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+# Gộp các request giống hệt nhau (cùng messages + tham số) đang chạy thành một lần gọi
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "1") == "1"
+
+# Lỗi tạm thời: mất kết nối, timeout, 429, 5xx
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_client: Optional[AsyncOpenAI] = None
+
+
+def get_llm_client() -> AsyncOpenAI:
+    """Client dùng chung cho cả process: một connection pool keep-alive tới LLM server."""
+    global _client
+    if _client is None:
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        )
+        # Retry do chat_completion tự làm (có jitter), SDK không retry thêm
+        _client = AsyncOpenAI(
+            api_key=LLM_API_KEY,
+            base_url=LLM_BASE_URL,
+            http_client=http_client,
+            max_retries=0,
+        )
+    return _client
+
+
+async def close_llm_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def retry_delay(attempt: int) -> float:
+    # Full jitter: nhiều request lỗi cùng lúc không retry đồng loạt
+    return random.uniform(0, LLM_RETRY_BACKOFF * 2 ** attempt)
+
+
+async def _create_with_retry(**kwargs):
+    attempt = 0
+    while True:
+        try:
+            return await get_llm_client().chat.completions.create(model=LLM_MODEL, **kwargs)
+        except RETRYABLE_ERRORS as exc:
+            if attempt >= LLM_MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt)
+            logger.warning("LLM call failed (%s), retrying in %.2fs", exc.__class__.__name__, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+async def _chat_completion(messages: List[dict], temperature: float, **kwargs) -> str:
+    response = await _create_with_retry(messages=messages, temperature=temperature, **kwargs)
+    return response.choices[0].message.content or ""
+
+
+async def _stream_chat_completion(messages: List[dict], temperature: float, **kwargs) -> AsyncIterator[str]:
+    stream = await _create_with_retry(messages=messages, temperature=temperature, stream=True, **kwargs)
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        with anyio.CancelScope(shield=True):
+            await stream.close()
+
+
+def request_key(messages: List[dict], temperature: float, **kwargs) -> str:
+    payload = {"model": LLM_MODEL, "messages": messages, "temperature": temperature, **kwargs}
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class _Flight:
+    """Một lần gọi LLM đang chạy, dùng chung cho mọi request cùng key.
+
+    Upstream chạy trong task riêng nên request khởi tạo bị hủy thì các request khác
+    vẫn nhận kết quả; chỉ khi không còn ai chờ thì task mới bị hủy (đóng kết nối tới
+    LLM server). Với stream, các delta được giữ lại để request tới sau phát lại từ đầu.
+    """
+
+    def __init__(self, flights: "dict[str, _Flight]", key: str):
+        self.flights = flights
+        self.key = key
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def pump(self, messages: List[dict], temperature: float, kwargs: dict) -> None:
+        try:
+            async with aclosing(_stream_chat_completion(messages, temperature, **kwargs)) as stream:
+                async for delta in stream:
+                    self.chunks.append(delta)
+                    self.notify()
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self.done = True
+            self.notify()
+
+    async def replay(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            if position < len(self.chunks):
+                end = len(self.chunks)
+                for delta in self.chunks[position:end]:
+                    yield delta
+                position = end
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                if self.task is not None and self.task.cancelled():
+                    raise RuntimeError("LLM stream was cancelled")
+                return
+            else:
+                await self._changed.wait()
+
+    def leave(self) -> None:
+        self.waiters -= 1
+        if self.waiters == 0 and self.task is not None and not self.task.done():
+            # Gỡ key ngay: request giống hệt tới trước khi done callback chạy phải mở flight mới
+            self.discard()
+            self.task.cancel()
+
+    def discard(self) -> None:
+        if self.flights.get(self.key) is self:
+            del self.flights[self.key]
+
+
+_flights: "dict[str, _Flight]" = {}
+_stream_flights: "dict[str, _Flight]" = {}
+_flights_started = 0
+_flights_coalesced = 0
+
+
+def _join(flights: "dict[str, _Flight]", key: str, start) -> _Flight:
+    global _flights_started, _flights_coalesced
+    flight = flights.get(key)
+    if flight is None:
+        flight = _Flight(flights, key)
+        flight.task = asyncio.create_task(start(flight))
+        flights[key] = flight
+        flight.task.add_done_callback(lambda _: flight.discard())
+        _flights_started += 1
+    else:
+        _flights_coalesced += 1
+    flight.waiters += 1
+    return flight
+
+
+def single_flight_stats() -> dict:
+    return {
+        "enabled": LLM_SINGLE_FLIGHT,
+        "started": _flights_started,
+        "coalesced": _flights_coalesced,
+        "inflight": len(_flights) + len(_stream_flights),
+    }
+
+
+async def chat_completion(messages: List[dict], temperature: float, **kwargs) -> str:
+    if not LLM_SINGLE_FLIGHT:
+        return await _chat_completion(messages, temperature, **kwargs)
+    flight = _join(
+        _flights,
+        request_key(messages, temperature, **kwargs),
+        lambda _: _chat_completion(messages, temperature, **kwargs),
+    )
+    try:
+        return await asyncio.shield(flight.task)
+    finally:
+        flight.leave()
+
+
+async def stream_chat_completion(messages: List[dict], temperature: float, **kwargs) -> AsyncIterator[str]:
+    """Trả về từng đoạn text ngay khi model sinh ra.
+
+    Chỉ retry lúc mở stream (chưa có token nào). Khi consumer dừng giữa chừng
+    (client ngắt kết nối -> task bị cancel) stream được đóng, kết nối HTTP tới
+    LLM server bị hủy nên server ngừng generate. Request giống hệt nhau tới cùng
+    lúc đọc chung một stream; upstream chỉ bị hủy khi mọi consumer đã dừng.
+    """
+    if not LLM_SINGLE_FLIGHT:
+        async with aclosing(_stream_chat_completion(messages, temperature, **kwargs)) as stream:
+            async for delta in stream:
+                yield delta
+        return
+    flight = _join(
+        _stream_flights,
+        request_key(messages, temperature, stream=True, **kwargs),
+        lambda flight: flight.pump(messages, temperature, kwargs),
+    )
+    try:
+        async with aclosing(flight.replay()) as deltas:
+            async for delta in deltas:
+                yield delta
+    finally:
+        flight.leave()
@@ -1,9 +1,12 @@
 import json
-import os
-from typing import List
+import logging
+from typing import AsyncIterator, List, Optional
 
-import anyio
-from openai import OpenAI
+from services.context_packer import get_tokenizer, pack_context
+from services.llm_client import chat_completion, stream_chat_completion
+from services.reply_parser import ReplyStreamParser, parse_reply, strip_json_fence
+
+logger = logging.getLogger(__name__)
 
 
 def _build_prompt(question: str, contexts: List[str], history: List[str]) -> str:
@@ -32,38 +35,68 @@ def _build_prompt(question: str, contexts: List[str], history: List[str]) -> str
     )
 
 
-def _strip_json_fence(content: str) -> str:
-    cleaned = content.strip()
-    if cleaned.startswith("```"):
-        cleaned = cleaned.replace("```json", "", 1).replace("```", "", 1).strip()
-    return cleaned
-
-
-async def generate_reply(question: str, contexts: List[str], history: List[str]) -> dict:
-
-
-    client = OpenAI(api_key="",base_url='http://localhost:11434/v1')
-    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    prompt = _build_prompt(question, contexts, history)
-
-    def _call():
-
-        response = client.chat.completions.create(
-            model="qwen2.5:7b",
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content
-
-    raw = await anyio.to_thread.run_sync(_call)
-    cleaned = _strip_json_fence(raw)
-    try:
-        data = json.loads(cleaned)
-        if isinstance(data, dict) and "reply" in data:
-            return data
-    except json.JSONDecodeError:
-        pass
-    return {"reply": raw.strip(), "diagram": None}
+def _reply_prompt(
+    question: str,
+    contexts: List[str],
+    history: List[str],
+    scores: Optional[List[float]],
+) -> tuple[str, int]:
+    packed = pack_context(contexts, history, scores)
+    prompt = _build_prompt(question, packed.contexts, packed.history)
+    prompt_tokens = get_tokenizer().count(prompt)
+    logger.info(
+        "Reply prompt: %s tokens (context %s, dropped %s chunks, truncated %s, dropped %s history lines)",
+        prompt_tokens,
+        packed.tokens,
+        packed.dropped_contexts,
+        packed.truncated_contexts,
+        packed.dropped_history,
+    )
+    return prompt, prompt_tokens
+
+
+async def generate_reply(
+    question: str,
+    contexts: List[str],
+    history: List[str],
+    scores: Optional[List[float]] = None,
+) -> dict:
+    prompt, prompt_tokens = _reply_prompt(question, contexts, history, scores)
+    raw = await chat_completion([{"role": "system", "content": prompt}], temperature=0.7)
+    data = parse_reply(raw)
+    data["prompt_tokens"] = prompt_tokens
+    return data
+
+
+async def stream_reply(
+    question: str,
+    contexts: List[str],
+    history: List[str],
+    scores: Optional[List[float]] = None,
+) -> AsyncIterator[dict]:
+    """Như generate_reply nhưng trả về event ngay khi model sinh token.
+
+    Event: {"type": "reply", "text": <đoạn mới>}, {"type": "diagram", "diagram": {...}},
+    cuối cùng {"type": "done", "reply": <toàn bộ>, "diagram": ..., "prompt_tokens": n}.
+    Chuỗi reply trong JSON được relay từng ký tự qua ReplyStreamParser, diagram
+    được gửi ngay khi object đóng. "reply" trong event done là bản chuẩn
+    (có thể khác phần đã stream nếu model trả JSON hỏng).
+    """
+    prompt, prompt_tokens = _reply_prompt(question, contexts, history, scores)
+    parser = ReplyStreamParser()
+    async for delta in stream_chat_completion([{"role": "system", "content": prompt}], temperature=0.7):
+        for event in parser.feed(delta):
+            yield event
+
+    events, data = parser.finish()
+    for event in events:
+        yield event
+    yield {
+        "type": "done",
+        "reply": str(data.get("reply") or "").strip(),
+        "diagram": data.get("diagram"),
+        "prompt_tokens": prompt_tokens,
+    }
 
 
 def _build_question_prompt(topic: str, contexts: List[str], count: int) -> str:
@@ -80,23 +113,24 @@ def _build_question_prompt(topic: str, contexts: List[str], count: int) -> str:
     )
 
 
-async def generate_questions(topic: str, contexts: List[str], count: int) -> List[dict]:
-
-
-    client = OpenAI(api_key="",base_url='http://localhost:11434/v1')
-    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    prompt = _build_question_prompt(topic, contexts, count)
-
-    def _call():
-        response = client.chat.completions.create(
-            model="qwen2.5:7b",
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content
+async def generate_questions(
+    topic: str,
+    contexts: List[str],
+    count: int,
+    scores: Optional[List[float]] = None,
+) -> List[dict]:
+    packed = pack_context(contexts, scores=scores)
+    prompt = _build_question_prompt(topic, packed.contexts, count)
+    logger.info(
+        "Question prompt: %s tokens (context %s, dropped %s chunks, truncated %s)",
+        get_tokenizer().count(prompt),
+        packed.tokens,
+        packed.dropped_contexts,
+        packed.truncated_contexts,
+    )
 
-    raw = await anyio.to_thread.run_sync(_call)
-    cleaned = _strip_json_fence(raw)
+    raw = await chat_completion([{"role": "system", "content": prompt}], temperature=0.7)
+    cleaned = strip_json_fence(raw)
     try:
         data = json.loads(cleaned)
         if isinstance(data, list):
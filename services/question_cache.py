@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+from services.llm_service import generate_questions
+from services.retrieval import context_fingerprint, normalize_query
+
+logger = logging.getLogger(__name__)
+
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "512"))
+QUESTION_CACHE_TTL = float(os.getenv("QUESTION_CACHE_TTL", "1800"))
+# Mỗi lần gọi LLM sinh sẵn ít nhất chừng này câu, các học sinh sau nhận tập con ngẫu nhiên.
+# Lần sinh đầu tốn hơn (count=1 vẫn sinh 10 câu) nhưng mọi count <= pool dùng chung một
+# key nên các request sau không gọi LLM nữa. 0 = sinh đúng count câu, key theo count.
+QUESTION_POOL_SIZE = int(os.getenv("QUESTION_POOL_SIZE", "10"))
+
+_cache: "OrderedDict[tuple, tuple[float, List[dict]]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_hits = 0
+_cache_misses = 0
+# Miss nhưng chờ chung lần sinh pool đang chạy (không tốn thêm lần gọi LLM)
+_coalesced = 0
+_inflight: "dict[tuple, asyncio.Task]" = {}
+
+
+def pool_size(count: int) -> int:
+    if QUESTION_POOL_SIZE <= 0:
+        return count
+    return max(count, QUESTION_POOL_SIZE)
+
+
+def _cache_get(key: tuple) -> Optional[List[dict]]:
+    global _cache_hits, _cache_misses
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] <= QUESTION_CACHE_TTL:
+            _cache.move_to_end(key)
+            _cache_hits += 1
+            return entry[1]
+        if entry is not None:
+            del _cache[key]
+        _cache_misses += 1
+        return None
+
+
+def _cache_put(key: tuple, pool: List[dict]) -> None:
+    if QUESTION_CACHE_SIZE <= 0 or not pool:
+        return
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), pool)
+        _cache.move_to_end(key)
+        while len(_cache) > QUESTION_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_question_cache() -> int:
+    with _cache_lock:
+        size = len(_cache)
+        _cache.clear()
+        return size
+
+
+def question_cache_stats() -> dict:
+    with _cache_lock:
+        lookups = _cache_hits + _cache_misses
+        return {
+            "hits": _cache_hits,
+            "misses": _cache_misses,
+            "coalesced": _coalesced,
+            "hit_rate": round(_cache_hits / lookups, 4) if lookups else 0.0,
+            "size": len(_cache),
+            "max_size": QUESTION_CACHE_SIZE,
+            "ttl": QUESTION_CACHE_TTL,
+            "pool_size": QUESTION_POOL_SIZE,
+            "inflight": len(_inflight),
+        }
+
+
+def _sample(pool: List[dict], count: int) -> List[dict]:
+    # Bản sao để người gọi sửa câu hỏi không làm hỏng pool trong cache
+    return [dict(item) for item in random.sample(pool, min(count, len(pool)))]
+
+
+async def cached_generate_questions(
+    topic: str,
+    grade: Optional[int],
+    context_ids: Sequence[str],
+    contexts: List[str],
+    count: int,
+    scores: Optional[List[float]] = None,
+) -> List[dict]:
+    """generate_questions có cache theo (topic, grade, tập chunk ngữ cảnh, kích thước pool).
+
+    Lần đầu sinh pool_size(count) câu rồi trả về tập con ngẫu nhiên count câu; các
+    request sau cùng key lấy mẫu lại từ pool tới khi hết TTL. Các request trùng key
+    tới trong lúc pool đang được sinh sẽ chờ chung một lần gọi LLM. Với
+    QUESTION_POOL_SIZE=0 pool chính là count câu được yêu cầu.
+    """
+    global _coalesced
+    size = pool_size(count)
+    key = (normalize_query(topic), grade, context_fingerprint(context_ids), size)
+    pool = _cache_get(key)
+    if pool is not None:
+        return _sample(pool, count)
+
+    task = _inflight.get(key)
+    if task is not None:
+        _coalesced += 1
+    else:
+        # Task riêng (không gắn với request đầu tiên): client đó ngắt kết nối thì
+        # các request đang chờ vẫn nhận được pool
+        task = asyncio.create_task(_generate_pool(key, topic, grade, contexts, size, scores))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return _sample(await asyncio.shield(task), count)
+
+
+async def _generate_pool(
+    key: tuple,
+    topic: str,
+    grade: Optional[int],
+    contexts: List[str],
+    size: int,
+    scores: Optional[List[float]],
+) -> List[dict]:
+    pool = await generate_questions(topic, contexts, size, scores=scores)
+    pool = [item for item in pool if isinstance(item, dict) and str(item.get("question_text", "")).strip()]
+    _cache_put(key, pool)
+    logger.info("Generated question pool of %s for topic %r (grade %s)", len(pool), topic, grade)
+    return pool
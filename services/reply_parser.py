@@ -0,0 +1,272 @@
+import json
+from typing import List, Optional
+
+_WHITESPACE = " \t\r\n"
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", '"': '"', "\\": "\\"}
+
+
+def strip_json_fence(content: str) -> str:
+    cleaned = content.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.replace("```json", "", 1).replace("```", "", 1).strip()
+    return cleaned
+
+
+def parse_reply(raw: str) -> dict:
+    cleaned = strip_json_fence(raw)
+    try:
+        data = json.loads(cleaned)
+        if isinstance(data, dict) and "reply" in data:
+            return data
+    except json.JSONDecodeError:
+        pass
+    return {"reply": raw.strip(), "diagram": None}
+
+
+class ReplyStreamParser:
+    """Parse dần output {"reply": "...", "diagram": {...}} theo từng delta của model.
+
+    feed() trả về event ngay khi có dữ liệu mới:
+    - {"type": "reply", "text": ...}: các ký tự mới của chuỗi reply (đã giải escape)
+    - {"type": "diagram", "diagram": {...}}: khi object diagram đóng ngoặc
+    Output không bắt đầu bằng "{" (hoặc ```json) được coi là text thường và relay
+    nguyên văn, trừ dòng ``` mở/đóng nếu text nằm trong fence. JSON hỏng giữa chừng thì dừng parse; finish() dùng parse_reply trên
+    toàn bộ output và chỉ bổ sung phần reply còn thiếu nếu phần đã gửi là tiền tố đúng.
+    """
+
+    def __init__(self):
+        self._raw: List[str] = []
+        self._mode = "json"
+        self._state = "start"
+        self._key: List[str] = []
+        self._current_key: Optional[str] = None
+        self._value: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._unicode: List[str] = []
+        self._high_surrogate: Optional[int] = None
+        self._reply: List[str] = []
+        self._values: dict = {}
+        self._diagram_sent = False
+        self._fenced = False
+
+    @property
+    def reply_so_far(self) -> str:
+        return "".join(self._reply)
+
+    def feed(self, delta: str) -> List[dict]:
+        self._raw.append(delta)
+        if self._mode == "text" and not self._fenced:
+            self._reply.append(delta)
+            return [{"type": "reply", "text": delta}]
+        if self._mode == "broken":
+            return []
+
+        events: List[dict] = []
+        emitted: List[str] = []
+        if self._mode == "json":
+            for char in delta:
+                self._step(char, emitted, events)
+                if self._mode != "json":
+                    break
+        if self._mode == "text":
+            # Không phải JSON: relay những gì đã nhận (bỏ dòng ``` nếu có)
+            text = self._plain_text()
+            sent = self.reply_so_far
+            self._reply = [text]
+            emitted = [text[len(sent):]] if len(text) > len(sent) else []
+        if emitted:
+            events.insert(0, {"type": "reply", "text": "".join(emitted)})
+        return events
+
+    def finish(self) -> tuple[List[dict], dict]:
+        """Trả về (event còn lại, kết quả cuối {"reply", "diagram", ...})."""
+        raw = "".join(self._raw)
+        if self._mode == "text":
+            return [], {"reply": self._plain_text().strip(), "diagram": None}
+        if self._mode == "json" and self._state == "done" and "reply" in self._values:
+            return [], {**self._values, "diagram": self._values.get("diagram")}
+        if isinstance(self._values.get("reply"), str):
+            # JSON hỏng sau khi chuỗi reply đã đóng: giữ phần đã parse được
+            return [], {**self._values, "diagram": self._values.get("diagram")}
+
+        data = parse_reply(raw)
+        reply = str(data.get("reply", ""))
+        events: List[dict] = []
+        sent = self.reply_so_far
+        if reply.startswith(sent) and len(reply) > len(sent):
+            events.append({"type": "reply", "text": reply[len(sent):]})
+        if data.get("diagram") and not self._diagram_sent:
+            events.append({"type": "diagram", "diagram": data["diagram"]})
+        return events, data
+
+    def _plain_text(self) -> str:
+        text = "".join(self._raw)
+        if not self._fenced:
+            return text.lstrip()
+        # Bỏ dòng mở ```lang; giữ lại dòng cuối khi nó có thể là ``` đóng
+        _, _, body = text.partition("\n")
+        body = body.strip()
+        head, newline, last = body.rpartition("\n")
+        if "```".startswith(last.strip()) and (newline or not last.strip()):
+            return head
+        return body
+
+    def _step(self, char: str, emitted: List[str], events: List[dict]) -> None:
+        state = self._state
+        if state == "start":
+            if char in _WHITESPACE:
+                return
+            if char == "`":
+                self._state = "fence"
+                self._fenced = True
+            elif char == "{":
+                self._state = "key_or_end"
+            else:
+                self._mode = "text"
+        elif state == "fence":
+            # Bỏ qua ```json tới hết dòng
+            if char == "\n":
+                self._state = "start"
+        elif state == "key_or_end":
+            if char in _WHITESPACE:
+                return
+            if char == '"':
+                self._key = []
+                self._state = "key"
+            elif char == "}":
+                self._state = "done"
+            else:
+                self._mode = "broken"
+        elif state == "key":
+            if self._escaped:
+                self._key.append(char)
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._current_key = "".join(self._key)
+                self._state = "colon"
+            else:
+                self._key.append(char)
+        elif state == "colon":
+            if char in _WHITESPACE:
+                return
+            if char == ":":
+                self._state = "value_start"
+            else:
+                self._mode = "broken"
+        elif state == "value_start":
+            if char in _WHITESPACE:
+                return
+            if self._current_key == "reply" and char == '"':
+                self._state = "reply"
+                return
+            self._value = [char]
+            self._depth = 1 if char in "{[" else 0
+            self._in_string = char == '"'
+            self._escaped = False
+            self._state = "value"
+            if self._depth == 0 and not self._in_string:
+                self._state = "scalar"
+        elif state == "reply":
+            self._step_reply(char, emitted)
+        elif state == "value":
+            self._value.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 0:
+                        self._complete_value(events)
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_value(events)
+        elif state == "scalar":
+            if char in _WHITESPACE or char in ",}":
+                self._complete_value(events)
+                if self._mode == "json":
+                    self._step(char, emitted, events)
+            else:
+                self._value.append(char)
+        elif state == "after_value":
+            if char in _WHITESPACE:
+                return
+            if char == ",":
+                self._state = "key_or_end"
+            elif char == "}":
+                self._state = "done"
+            else:
+                self._mode = "broken"
+
+    def _step_reply(self, char: str, emitted: List[str]) -> None:
+        if self._unicode:
+            self._unicode.append(char)
+            if len(self._unicode) == 5:
+                try:
+                    code = int("".join(self._unicode[1:]), 16)
+                except ValueError:
+                    # \u không hợp lệ: để finish() xử lý bằng parse_reply
+                    self._mode = "broken"
+                    return
+                self._unicode = []
+                self._emit_code_unit(code, emitted)
+            return
+        if self._escaped:
+            self._escaped = False
+            if char == "u":
+                self._unicode = ["u"]
+            else:
+                self._emit_reply(_ESCAPES.get(char, char), emitted)
+            return
+        if char == "\\":
+            self._escaped = True
+        elif char == '"':
+            self._flush_surrogate(emitted)
+            self._values["reply"] = self.reply_so_far
+            self._state = "after_value"
+        else:
+            self._emit_reply(char, emitted)
+
+    def _emit_code_unit(self, code: int, emitted: List[str]) -> None:
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_surrogate(emitted)
+            self._high_surrogate = code
+        elif 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            high, self._high_surrogate = self._high_surrogate, None
+            self._emit_reply(chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00)), emitted)
+        else:
+            self._emit_reply(chr(code), emitted)
+
+    def _flush_surrogate(self, emitted: List[str]) -> None:
+        if self._high_surrogate is not None:
+            self._high_surrogate = None
+            self._reply.append("\ufffd")
+            emitted.append("\ufffd")
+
+    def _emit_reply(self, text: str, emitted: List[str]) -> None:
+        if self._high_surrogate is not None:
+            self._flush_surrogate(emitted)
+        self._reply.append(text)
+        emitted.append(text)
+
+    def _complete_value(self, events: List[dict]) -> None:
+        try:
+            value = json.loads("".join(self._value))
+        except json.JSONDecodeError:
+            self._mode = "broken"
+            return
+        self._values[self._current_key] = value
+        if self._current_key == "diagram" and value:
+            self._diagram_sent = True
+            events.append({"type": "diagram", "diagram": value})
+        self._state = "after_value"
@@ -0,0 +1,394 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import anyio
+
+from services.chroma_service import EMBEDDING_BACKEND, collection, ef, grade_partition
+from services.diversity import select_diverse
+from services.lexical_index import build_lexical_index, lexical_index
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+# Version chỉ được tăng trong process chạy ingest; TTL giới hạn độ trễ ở các worker khác
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "300"))
+# Số ứng viên lấy từ mỗi nhánh (vector, BM25) trước khi trộn
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = 60
+# Gom các query tới trong cửa sổ này thành một lần embed + collection.query
+RETRIEVAL_BATCH_WINDOW_MS = float(os.getenv("RETRIEVAL_BATCH_WINDOW_MS", "5"))
+RETRIEVAL_BATCH_MAX = int(os.getenv("RETRIEVAL_BATCH_MAX", "32"))
+
+_embedding_cache: "OrderedDict[str, list]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+_embedding_cache_hits = 0
+_embedding_cache_misses = 0
+
+_collection_version = 0
+_result_cache: "OrderedDict[tuple, tuple[float, dict]]" = OrderedDict()
+_result_cache_lock = threading.Lock()
+_result_cache_hits = 0
+_result_cache_misses = 0
+
+
+def normalize_query(text: str) -> str:
+    # all-MiniLM-L6-v2 là model uncased nên lowercase không làm đổi vector
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+def embed_queries(texts: List[str]) -> list:
+    """Embed nhiều câu hỏi; các câu chưa có trong cache được embed chung một lượt."""
+    global _embedding_cache_hits, _embedding_cache_misses
+    normalized = [normalize_query(text) for text in texts]
+    vectors = {}
+    with _embedding_cache_lock:
+        for text in normalized:
+            vector = _embedding_cache.get(text)
+            if vector is not None:
+                _embedding_cache.move_to_end(text)
+                vectors[text] = vector
+                _embedding_cache_hits += 1
+            else:
+                _embedding_cache_misses += 1
+    missing = [text for text in dict.fromkeys(normalized) if text not in vectors]
+    if missing:
+        # Chạy model ngoài lock để các thread khác vẫn đọc được cache
+        vectors.update(zip(missing, ef(missing)))
+        with _embedding_cache_lock:
+            for text in missing:
+                _embedding_cache[text] = vectors[text]
+            while len(_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                _embedding_cache.popitem(last=False)
+    return [vectors[text] for text in normalized]
+
+
+def embed_query(text: str):
+    return embed_queries([text])[0]
+
+
+def embedding_cache_stats() -> dict:
+    with _embedding_cache_lock:
+        lookups = _embedding_cache_hits + _embedding_cache_misses
+        return {
+            "hits": _embedding_cache_hits,
+            "misses": _embedding_cache_misses,
+            "hit_rate": round(_embedding_cache_hits / lookups, 4) if lookups else 0.0,
+            "size": len(_embedding_cache),
+            "max_size": QUERY_EMBEDDING_CACHE_SIZE,
+            "backend": EMBEDDING_BACKEND,
+        }
+
+
+def context_fingerprint(context_ids: Sequence[str]) -> str:
+    # Không phụ thuộc thứ tự: cùng tập chunk thì cùng ngữ cảnh cho LLM
+    return hashlib.sha1("\n".join(sorted(context_ids)).encode("utf-8")).hexdigest()
+
+
+def bump_collection_version() -> int:
+    """Gọi sau mọi thay đổi trên collection (ingest, xóa chunk, rebuild)."""
+    global _collection_version
+    with _result_cache_lock:
+        _collection_version += 1
+        _result_cache.clear()
+        return _collection_version
+
+
+async def load_lexical_index(session_factory) -> None:
+    """Nạp BM25 rồi bỏ các kết quả đã cache lúc search() còn chỉ dùng vector."""
+    if await build_lexical_index(session_factory):
+        bump_collection_version()
+
+
+def _cache_get(key: tuple) -> Optional[dict]:
+    global _result_cache_hits, _result_cache_misses
+    with _result_cache_lock:
+        entry = _result_cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] <= RETRIEVAL_CACHE_TTL:
+            _result_cache.move_to_end(key)
+            _result_cache_hits += 1
+            return entry[1]
+        if entry is not None:
+            del _result_cache[key]
+        _result_cache_misses += 1
+        return None
+
+
+def _cache_put(key: tuple, result: dict) -> None:
+    with _result_cache_lock:
+        if key[0] != _collection_version:
+            return
+        _result_cache[key] = (time.monotonic(), result)
+        _result_cache.move_to_end(key)
+        while len(_result_cache) > RETRIEVAL_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+
+def result_cache_stats() -> dict:
+    with _result_cache_lock:
+        lookups = _result_cache_hits + _result_cache_misses
+        return {
+            "hits": _result_cache_hits,
+            "misses": _result_cache_misses,
+            "hit_rate": round(_result_cache_hits / lookups, 4) if lookups else 0.0,
+            "size": len(_result_cache),
+            "max_size": RETRIEVAL_CACHE_SIZE,
+            "collection_version": _collection_version,
+        }
+
+
+RESULT_FIELDS = ("ids", "documents", "metadatas", "distances", "embeddings")
+
+
+def _where_key(where: Optional[dict]) -> Optional[str]:
+    return json.dumps(where, sort_keys=True) if where is not None else None
+
+
+def _query_key(query_text: str, n_results: int, include, where: Optional[dict], grade: Optional[int]) -> tuple:
+    return (
+        _collection_version,
+        normalize_query(query_text),
+        n_results,
+        tuple(include),
+        _where_key(where),
+        grade,
+    )
+
+
+def _query_rows(target, embeddings: list, n_results: int, include, where: Optional[dict]) -> List[dict]:
+    query_kwargs = {
+        # Query bằng vector đã cache thay vì query_texts -> câu hỏi lặp lại không chạy lại model
+        "query_embeddings": embeddings,
+        "n_results": n_results,
+        "include": list(include),
+    }
+    if where is not None:
+        query_kwargs["where"] = where
+    batch_result = target.query(**query_kwargs)
+    return [
+        {field: [batch_result[field][row]] for field in RESULT_FIELDS if batch_result.get(field) is not None}
+        for row in range(len(embeddings))
+    ]
+
+
+def _query_batch(requests: List[tuple]) -> List[dict]:
+    """Chạy nhiều query (query_text, n_results, include, where, grade) trong một lượt.
+
+    Tất cả câu hỏi được embed chung một batch; các query cùng include/where/grade
+    dùng chung một lần query với n_results lớn nhất rồi cắt lại cho từng câu.
+    Query có grade chạy trên partition của grade đó; câu nào không có kết quả
+    (partition rỗng/chưa có) được query lại trên collection chung bằng chính vector đó.
+    Kết quả có thêm "partition": grade đã dùng, hoặc None nếu là collection chung.
+    """
+    embeddings = embed_queries([request[0] for request in requests])
+    groups: dict[tuple, List[int]] = {}
+    for position, (_, _, include, where, grade) in enumerate(requests):
+        groups.setdefault((tuple(include), _where_key(where), grade), []).append(position)
+
+    results: List[Optional[dict]] = [None] * len(requests)
+    for positions in groups.values():
+        _, _, include, where, grade = requests[positions[0]]
+        n_results = max(requests[position][1] for position in positions)
+        fallback = positions
+        partition = grade_partition(grade) if grade is not None else None
+        if partition is not None:
+            rows = _query_rows(partition, [embeddings[position] for position in positions], n_results, include, where)
+            fallback = []
+            for position, row in zip(positions, rows):
+                if row["ids"][0]:
+                    results[position] = {**row, "partition": grade}
+                else:
+                    fallback.append(position)
+        if fallback:
+            rows = _query_rows(collection, [embeddings[position] for position in fallback], n_results, include, where)
+            for position, row in zip(fallback, rows):
+                results[position] = {**row, "partition": None}
+
+    for position, result in enumerate(results):
+        n_results = requests[position][1]
+        for field in RESULT_FIELDS:
+            if field in result:
+                result[field] = [result[field][0][:n_results]]
+    return results
+
+
+class QueryBatcher:
+    """Gom các query đồng thời trên event loop thành batch, chạy trong worker thread.
+
+    Query đầu tiên mở một cửa sổ RETRIEVAL_BATCH_WINDOW_MS; mọi query tới trong
+    cửa sổ (tối đa RETRIEVAL_BATCH_MAX) đi chung một lần _query_batch.
+    """
+
+    def __init__(self, window_ms: float = RETRIEVAL_BATCH_WINDOW_MS, max_batch: int = RETRIEVAL_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self.batches = 0
+        self.queries = 0
+
+    async def submit(
+        self,
+        query_text: str,
+        n_results: int,
+        include: List[str],
+        where: Optional[dict] = None,
+        grade: Optional[int] = None,
+    ) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((query_text, n_results, tuple(include), where, grade), future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[tuple]) -> None:
+        self.batches += 1
+        self.queries += len(batch)
+        try:
+            results = await anyio.to_thread.run_sync(_query_batch, [request for request, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future), result in zip(batch, results):
+            # Request đã bị hủy (client ngắt kết nối) thì bỏ kết quả
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+        }
+
+
+query_batcher = QueryBatcher()
+
+
+async def query_collection_async(
+    query_text: str,
+    n_results: int,
+    include: List[str],
+    where: Optional[dict] = None,
+    grade: Optional[int] = None,
+) -> dict:
+    key = _query_key(query_text, n_results, include, where, grade)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    result = await query_batcher.submit(query_text, n_results, include, where, grade)
+    _cache_put(key, result)
+    return result
+
+
+def _fuse(query_text: str, n_results: int, where: Optional[dict], vector: dict) -> dict:
+    vector_ids = vector.get("ids", [[]])[0]
+    documents = dict(zip(vector_ids, vector.get("documents", [[]])[0]))
+    distances = dict(zip(vector_ids, vector.get("distances", [[]])[0]))
+    embeddings = dict(zip(vector_ids, vector.get("embeddings", [[]])[0]))
+    candidates = max(n_results, HYBRID_CANDIDATES)
+
+    lexical_ids: List[str] = []
+    # BM25 chỉ lọc được theo grade: có filter metadata khác thì bỏ nhánh lexical.
+    # Grade theo partition mà nhánh vector thực sự dùng (None nếu đã fallback).
+    if where is None and lexical_index.ready:
+        lexical_ids = [
+            chunk_id
+            for chunk_id, _ in lexical_index.search(query_text, candidates, grade=vector.get("partition"))
+        ]
+
+    fused: dict[str, float] = {}
+    for ranking in (vector_ids, lexical_ids):
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    pool = sorted(fused, key=fused.get, reverse=True)[:candidates]
+
+    missing = [chunk_id for chunk_id in pool if chunk_id not in documents]
+    if missing:
+        fetched = collection.get(ids=missing, include=["documents", "embeddings"])
+        documents.update(zip(fetched["ids"], fetched["documents"]))
+        embeddings.update(zip(fetched["ids"], fetched["embeddings"]))
+    # Chunk có trong BM25 nhưng đã bị xóa khỏi Chroma thì bỏ qua
+    pool = [chunk_id for chunk_id in pool if chunk_id in documents]
+    if not pool:
+        # Store rỗng / chưa rebuild / where không khớp: caller tự xử lý khi không có ngữ cảnh
+        return {"ids": [[]], "documents": [[]], "distances": [[]], "scores": [[]]}
+
+    # Cả pool ứng viên đi qua dedupe + MMR: n_results chunk trả về không lặp nội dung
+    chosen = select_diverse(
+        [documents[chunk_id] for chunk_id in pool],
+        [embeddings.get(chunk_id) for chunk_id in pool],
+        [fused[chunk_id] for chunk_id in pool],
+        n_results,
+    )
+    top = [pool[position] for position in chosen]
+
+    return {
+        "ids": [top],
+        "documents": [[documents[chunk_id] for chunk_id in top]],
+        "distances": [[distances.get(chunk_id) for chunk_id in top]],
+        "scores": [[round(fused[chunk_id], 6) for chunk_id in top]],
+    }
+
+
+async def search(
+    query_text: str,
+    n_results: int,
+    where: Optional[dict] = None,
+    grade: Optional[int] = None,
+) -> dict:
+    """Hybrid: vector (Chroma) + BM25 (lexical_index), trộn bằng Reciprocal Rank Fusion.
+
+    Trả về dict cùng dạng kết quả Chroma (ids/documents/distances lồng một lớp)
+    kèm "scores" là điểm RRF. Chunk chỉ khớp từ khóa có distance = None.
+    Ứng viên được over-fetch rồi lọc trùng + chọn theo MMR (services.diversity).
+    Khi lexical index chưa nạp xong thì chỉ dùng vector.
+    grade chọn partition (where, vd. {"topic": ...}, lọc tiếp trong partition);
+    partition không có kết quả thì dùng collection chung, "partition" trong kết quả là None.
+    """
+    key = (
+        _collection_version,
+        "search",
+        normalize_query(query_text),
+        n_results,
+        _where_key(where),
+        grade,
+    )
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    candidates = max(n_results, HYBRID_CANDIDATES)
+    vector = await query_collection_async(
+        query_text, candidates, ["documents", "distances", "embeddings"], where=where, grade=grade
+    )
+    # BM25 + collection.get là code đồng bộ -> cũng chạy ngoài event loop
+    result = await anyio.to_thread.run_sync(_fuse, query_text, n_results, where, vector)
+    result["partition"] = vector.get("partition")
+    _cache_put(key, result)
+    return result
@@ -0,0 +1,62 @@
+import hashlib
+import os
+import tempfile
+
+import anyio
+from fastapi import UploadFile
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def stored_path(content_hash: str, filename: str) -> str:
+    ext = os.path.splitext(filename or "")[-1].lower()
+    return os.path.join(UPLOAD_DIR, f"{content_hash}{ext}")
+
+
+async def store_upload(file: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> tuple[str, str, int]:
+    """Ghi file vào uploads/ theo sha256 của nội dung.
+
+    Đọc từng khối bất đồng bộ; hash + ghi đĩa của mỗi khối chạy trong worker
+    thread nên event loop không bị chặn. Hash và số byte được tính trong cùng
+    một lượt đọc; vượt max_bytes thì dừng và xóa bản tạm (kiểm tra phòng hờ: lúc
+    này Starlette đã spool xong body, chặn sớm là việc của UploadSizeLimit trong main).
+    Nếu nội dung đã tồn tại trên đĩa thì bản tạm bị xóa, không ghi thêm bản sao.
+    Trả về (content_hash, file_path, size).
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            def _consume(block: bytes) -> None:
+                hasher.update(block)
+                buffer.write(block)
+
+            while True:
+                block = await file.read(READ_CHUNK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File exceeds {max_bytes} bytes")
+                await anyio.to_thread.run_sync(_consume, block)
+
+        content_hash = hasher.hexdigest()
+        file_path = stored_path(content_hash, file.filename)
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return content_hash, file_path, size
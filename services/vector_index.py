@@ -0,0 +1,230 @@
+"""Đồng bộ vector store với bảng document_chunks.
+
+    python -m services.vector_index --check     # chỉ báo trạng thái
+    python -m services.vector_index             # embed các chunk còn thiếu vector
+    python -m services.vector_index --force     # embed lại toàn bộ
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+import anyio
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.database import AsyncSessionLocal
+from models.chunk_embedding import ChunkEmbedding
+from models.document_chunk import DocumentChunk
+from models.documents import Documents
+from services.chroma_service import chunk_metadata, collection, delete_chunks, grade_partition, grade_partitions, upsert_chunks
+from services.chunk_store import EMBED_BATCH_SIZE
+from services.retrieval import bump_collection_version
+
+logger = logging.getLogger(__name__)
+
+CHROMA_REBUILD_ON_STARTUP = os.getenv("CHROMA_REBUILD_ON_STARTUP", "0") == "1"
+
+_rebuild_task: asyncio.Task | None = None
+
+
+async def index_status(db: AsyncSession) -> dict:
+    result = await db.execute(select(func.count()).select_from(DocumentChunk))
+    chunks = result.scalar_one()
+    result = await db.execute(
+        select(Documents.grade, func.count())
+        .select_from(DocumentChunk)
+        .join(Documents, Documents.id == DocumentChunk.document_id)
+        .where(Documents.grade.is_not(None))
+        .group_by(Documents.grade)
+    )
+    graded_chunks = {int(grade): count for grade, count in result.all()}
+    vectors = await anyio.to_thread.run_sync(collection.count)
+
+    def _partition_counts():
+        return {grade: partition.count() for grade, partition in grade_partitions().items()}
+
+    partitions = await anyio.to_thread.run_sync(_partition_counts)
+    # So từng grade: tổng bằng nhau vẫn có thể lệch giữa các partition
+    stale_partitions = sorted(
+        grade
+        for grade in set(graded_chunks) | set(partitions)
+        if graded_chunks.get(grade, 0) != partitions.get(grade, 0)
+    )
+    return {
+        "chunks": chunks,
+        "vectors": vectors,
+        "partitions": partitions,
+        "stale_partitions": stale_partitions,
+        "stale": chunks != vectors or bool(stale_partitions),
+    }
+
+
+async def _orphan_ids(db: AsyncSession, target, batch_size: int, grade: int | None = None) -> list[str]:
+    # Vector không còn chunk tương ứng trong Postgres (document đã bị xóa...);
+    # với partition: cả vector của chunk không còn thuộc grade đó
+    orphans = []
+    offset = 0
+    while True:
+        page = await anyio.to_thread.run_sync(
+            lambda: target.get(include=[], limit=batch_size, offset=offset)
+        )
+        ids = page["ids"]
+        if not ids:
+            break
+        offset += len(ids)
+        chunk_ids = []
+        for chunk_id in ids:
+            try:
+                chunk_ids.append(uuid.UUID(chunk_id))
+            except ValueError:
+                pass
+        stmt = select(DocumentChunk.id).where(DocumentChunk.id.in_(chunk_ids))
+        if grade is not None:
+            stmt = stmt.join(Documents, Documents.id == DocumentChunk.document_id).where(Documents.grade == grade)
+        result = await db.execute(stmt)
+        known = {str(chunk_id) for chunk_id in result.scalars().all()}
+        orphans.extend(chunk_id for chunk_id in ids if chunk_id not in known)
+    return orphans
+
+
+async def _prune_orphans(db: AsyncSession, batch_size: int) -> int:
+    orphans = await _orphan_ids(db, collection, batch_size)
+    for start in range(0, len(orphans), batch_size):
+        batch = orphans[start:start + batch_size]
+        await anyio.to_thread.run_sync(delete_chunks, batch)
+    pruned = len(orphans)
+
+    # delete_chunks đã xóa các id trên khỏi mọi partition; quét thêm từng partition
+    # để bắt vector chỉ còn sót ở partition (hoặc nằm sai grade)
+    partitions = await anyio.to_thread.run_sync(grade_partitions)
+    for grade, partition in partitions.items():
+        partition_orphans = await _orphan_ids(db, partition, batch_size, grade=grade)
+        for start in range(0, len(partition_orphans), batch_size):
+            batch = partition_orphans[start:start + batch_size]
+            await anyio.to_thread.run_sync(lambda: partition.delete(ids=batch))
+        pruned += len(partition_orphans)
+
+    if pruned:
+        bump_collection_version()
+    return pruned
+
+
+def _missing_vectors(items: list[tuple[str, int | None]]) -> set[str]:
+    # Thiếu ở collection chung hoặc ở partition của grade (vd. dữ liệu trước khi có partition)
+    ids = [chunk_id for chunk_id, _ in items]
+    missing = set(ids) - set(collection.get(ids=ids, include=[])["ids"])
+    by_grade: dict[int, list[str]] = {}
+    for chunk_id, grade in items:
+        if grade is not None:
+            by_grade.setdefault(grade, []).append(chunk_id)
+    for grade, grade_ids in by_grade.items():
+        partition = grade_partition(grade, create=True)
+        missing |= set(grade_ids) - set(partition.get(ids=grade_ids, include=[])["ids"])
+    return missing
+
+
+async def rebuild_index(db: AsyncSession, *, force: bool = False, batch_size: int = EMBED_BATCH_SIZE) -> dict:
+    """Embed lại từ document_chunks theo batch (keyset theo id, bộ nhớ phẳng).
+
+    Mặc định chỉ embed các chunk chưa có trong vector store; force=True embed lại tất cả.
+    """
+    embedded = 0
+    scanned = 0
+    last_id = None
+    while True:
+        stmt = (
+            select(DocumentChunk, Documents, ChunkEmbedding.id)
+            .join(Documents, Documents.id == DocumentChunk.document_id)
+            .outerjoin(ChunkEmbedding, ChunkEmbedding.chunk_id == DocumentChunk.id)
+            .order_by(DocumentChunk.id)
+            .limit(batch_size)
+        )
+        if last_id is not None:
+            stmt = stmt.where(DocumentChunk.id > last_id)
+        rows = (await db.execute(stmt)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0].id
+        scanned += len(rows)
+
+        ids = [str(chunk.id) for chunk, _, _ in rows]
+        if force:
+            missing = set(ids)
+        else:
+            missing = await anyio.to_thread.run_sync(
+                _missing_vectors, [(str(chunk.id), document.grade) for chunk, document, _ in rows]
+            )
+
+        todo = [(chunk, document) for chunk, document, _ in rows if str(chunk.id) in missing]
+        if todo:
+            await anyio.to_thread.run_sync(
+                upsert_chunks,
+                [str(chunk.id) for chunk, _ in todo],
+                [chunk.content for chunk, _ in todo],
+                [chunk_metadata(document) for _, document in todo],
+            )
+            embedded += len(todo)
+            bump_collection_version()
+
+        without_record = [chunk.id for chunk, _, embedding_id in rows if embedding_id is None]
+        if without_record:
+            await db.execute(
+                insert(ChunkEmbedding),
+                [{"chunk_id": chunk_id, "embedding_id": str(chunk_id)} for chunk_id in without_record],
+            )
+        await db.commit()
+        db.expunge_all()
+
+    pruned = await _prune_orphans(db, batch_size)
+    return {"scanned": scanned, "embedded": embedded, "pruned": pruned}
+
+
+async def _rebuild_in_background() -> None:
+    try:
+        async with AsyncSessionLocal() as db:
+            stats = await rebuild_index(db)
+        logger.info("Vector index rebuilt: %s", stats)
+    except Exception:
+        logger.exception("Vector index rebuild failed")
+
+
+async def ensure_vector_index() -> None:
+    """Gọi lúc khởi động: báo index thiếu/lệch, tùy chọn tự rebuild ở background."""
+    global _rebuild_task
+    try:
+        async with AsyncSessionLocal() as db:
+            status = await index_status(db)
+    except Exception:
+        logger.exception("Could not check vector index status")
+        return
+    if not status["stale"]:
+        return
+    logger.warning(
+        "Vector store out of sync with document_chunks (%s vectors, %s chunks, collection %s)",
+        status["vectors"],
+        status["chunks"],
+        collection.name,
+    )
+    if CHROMA_REBUILD_ON_STARTUP and _rebuild_task is None:
+        _rebuild_task = asyncio.create_task(_rebuild_in_background())
+
+
+async def _main(args) -> None:
+    async with AsyncSessionLocal() as db:
+        if args.check:
+            print(json.dumps(await index_status(db)))
+            return
+        stats = await rebuild_index(db, force=args.force, batch_size=args.batch_size)
+        stats.update(await index_status(db))
+        print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    asyncio.run(_main(parser.parse_args()))
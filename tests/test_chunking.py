@@ -0,0 +1,21 @@
+from services.chunking import _split_tokens, count_tokens, iter_chunks
+
+
+def test_split_tokens_keeps_multibyte_characters():
+    word = "nghiêng" * 15 + "ệ" * 20
+    pieces = list(_split_tokens(word, 3))
+    assert len(pieces) > 1
+    assert "".join(piece for piece, _ in pieces) == word
+    assert all("�" not in piece for piece, _ in pieces)
+
+
+def test_overlap_starts_at_word_boundary():
+    first = " ".join(f"từ{i}" for i in range(60))
+    second = " ".join(f"câu{i}" for i in range(10))
+    chunks = list(iter_chunks([(1, first), (2, second)], max_tokens=count_tokens(first) + 5, overlap=23))
+    assert len(chunks) == 2
+    carried, rest = chunks[1].content.split("\n")
+    assert rest == second
+    assert carried and first.endswith(" " + carried)
+    assert count_tokens(carried) <= 23
+    assert chunks[1].page_start == 1 and chunks[1].page_end == 2
@@ -0,0 +1,59 @@
+import pytest
+
+from services import context_packer
+from services.context_packer import Tokenizer, pack_context
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer(monkeypatch):
+    # Mỗi từ một token: không cần tải tokenizer thật
+    vocab: list = []
+
+    def encode(text):
+        tokens = []
+        for word in text.split():
+            if word not in vocab:
+                vocab.append(word)
+            tokens.append(vocab.index(word))
+        return tokens
+
+    tokenizer = Tokenizer(
+        name="words",
+        encode=encode,
+        decode=lambda tokens: " ".join(vocab[token] for token in tokens),
+    )
+    monkeypatch.setattr(context_packer, "get_tokenizer", lambda: tokenizer)
+
+
+def words(prefix, count):
+    return " ".join(f"{prefix}{index}" for index in range(count))
+
+
+def test_history_is_packed_first_newest_lines_kept():
+    history = [words("old", 5), words("mid", 5), words("new", 5)]
+    packed = pack_context([words("c", 10)], history, budget=100, history_budget=12)
+    assert packed.history == history[1:]
+    assert packed.dropped_history == 1
+    assert packed.contexts == [words("c", 10)]
+    assert packed.tokens == 12 + 12
+
+
+def test_lowest_scored_chunk_is_truncated_or_dropped():
+    contexts = [words("low", 100), words("high", 40), words("mid", 100)]
+    packed = pack_context(
+        contexts, scores=[0.1, 0.9, 0.5], budget=100, history_budget=0,
+    )
+    # high (42) vừa; mid bị cắt còn 100 - 42 - 2 = 56 token; low không còn chỗ
+    assert packed.contexts[0] == contexts[1]
+    assert packed.contexts[1] == words("mid", 56)
+    assert packed.truncated_contexts == 1
+    assert packed.dropped_contexts == 1
+    assert packed.tokens == 100
+
+
+def test_remainder_below_minimum_is_dropped_not_truncated():
+    contexts = [words("a", 70), words("b", 60)]
+    packed = pack_context(contexts, budget=100, history_budget=0)
+    assert packed.contexts == [contexts[0]]
+    assert packed.truncated_contexts == 0
+    assert packed.dropped_contexts == 1
@@ -0,0 +1,30 @@
+from services.diversity import select_diverse
+
+
+def test_empty_pool():
+    assert select_diverse([], [], [], 3) == []
+
+
+def test_exact_duplicates_removed_by_hash():
+    texts = ["Phân số là gì", "  phân   số là GÌ ", "Số nguyên tố"]
+    embeddings = [[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]]
+    assert select_diverse(texts, embeddings, [3.0, 2.0, 1.0], 3) == [0, 2]
+
+
+def test_near_duplicates_removed_by_vector():
+    texts = ["a", "b", "c"]
+    embeddings = [[1.0, 0.0], [0.999, 0.01], [0.0, 1.0]]
+    assert select_diverse(texts, embeddings, [3.0, 2.0, 1.0], 3, threshold=0.95) == [0, 2]
+
+
+def test_missing_vectors_only_dedupes_by_hash():
+    texts = ["a", "a", "b", "c"]
+    # Vector giống hệt nhau nhưng một chunk thiếu vector: không lọc gần trùng
+    embeddings = [[1.0, 0.0], [1.0, 0.0], None, [1.0, 0.0]]
+    assert select_diverse(texts, embeddings, [4.0, 3.0, 2.0, 1.0], 3) == [0, 2, 3]
+
+
+def test_k_limits_result():
+    texts = ["a", "b", "c"]
+    embeddings = [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]]
+    assert len(select_diverse(texts, embeddings, [3.0, 2.0, 1.0], 2)) == 2
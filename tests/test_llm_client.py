@@ -0,0 +1,74 @@
+import asyncio
+
+from services import llm_client
+
+MESSAGES = [{"role": "system", "content": "prompt"}]
+
+
+def test_identical_requests_share_one_call(monkeypatch):
+    calls = []
+
+    async def fake_completion(messages, temperature, **kwargs):
+        calls.append(messages)
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    monkeypatch.setattr(llm_client, "LLM_SINGLE_FLIGHT", True)
+    monkeypatch.setattr(llm_client, "_chat_completion", fake_completion)
+
+    async def main():
+        return await asyncio.gather(*[llm_client.chat_completion(MESSAGES, 0.7) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["ok"] * 5
+    assert len(calls) == 1
+
+
+def test_reissue_after_sole_waiter_cancelled(monkeypatch):
+    calls = []
+
+    async def fake_completion(messages, temperature, **kwargs):
+        calls.append(messages)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    monkeypatch.setattr(llm_client, "LLM_SINGLE_FLIGHT", True)
+    monkeypatch.setattr(llm_client, "_chat_completion", fake_completion)
+
+    async def main():
+        first = asyncio.create_task(llm_client.chat_completion(MESSAGES, 0.7))
+        await asyncio.sleep(0)
+        first.cancel()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        # Done callback của flight bị hủy chưa chạy: request mới không được dính vào nó
+        return await llm_client.chat_completion(MESSAGES, 0.7)
+
+    assert asyncio.run(main()) == "ok"
+    assert len(calls) == 2
+
+
+def test_stream_reissue_after_sole_waiter_cancelled(monkeypatch):
+    async def fake_stream(messages, temperature, **kwargs):
+        for delta in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield delta
+
+    monkeypatch.setattr(llm_client, "LLM_SINGLE_FLIGHT", True)
+    monkeypatch.setattr(llm_client, "_stream_chat_completion", fake_stream)
+
+    async def collect():
+        return "".join([delta async for delta in llm_client.stream_chat_completion(MESSAGES, 0.7)])
+
+    async def main():
+        first = asyncio.create_task(collect())
+        await asyncio.sleep(0.015)
+        first.cancel()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        return await collect()
+
+    assert asyncio.run(main()) == "abc"
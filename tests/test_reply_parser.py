@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from services.reply_parser import ReplyStreamParser, parse_reply
+
+OBJECT = {
+    "reply": "Chào em \"bạn\"\n\\ 😀 é",
+    "diagram": {"width": 400, "height": 300, "shapes": [{"type": "point", "label": "A}\"{"}]},
+}
+
+
+def run(raw, step=1):
+    parser = ReplyStreamParser()
+    events = []
+    for start in range(0, len(raw), step):
+        events += parser.feed(raw[start:start + step])
+    rest, data = parser.finish()
+    events += rest
+    text = "".join(event["text"] for event in events if event["type"] == "reply")
+    diagrams = [event["diagram"] for event in events if event["type"] == "diagram"]
+    return text, diagrams, data
+
+
+@pytest.mark.parametrize("step", [1, 2, 3, 5, 7])
+def test_escapes_split_across_chunks(step):
+    text, diagrams, data = run(json.dumps(OBJECT), step)
+    assert text == OBJECT["reply"]
+    assert diagrams == [OBJECT["diagram"]]
+    assert data["reply"] == OBJECT["reply"]
+
+
+def test_surrogate_pair_decoded():
+    raw = '{"reply": "x \\ud83d\\ude00 y"}'
+    assert run(raw)[0] == "x 😀 y"
+
+
+def test_fenced_json():
+    text, diagrams, data = run("```json\n" + json.dumps(OBJECT) + "\n```", 4)
+    assert text == OBJECT["reply"]
+    assert diagrams == [OBJECT["diagram"]]
+
+
+def test_plain_text_relayed():
+    text, diagrams, data = run("  Xin chào em", 3)
+    assert text == "Xin chào em"
+    assert data == {"reply": "Xin chào em", "diagram": None}
+    assert diagrams == []
+
+
+def test_truncated_json_falls_back():
+    text, diagrams, data = run('{"reply": "abc')
+    assert text == "abc"
+    assert data["diagram"] is None
+
+
+def test_broken_after_reply_keeps_parsed_reply():
+    text, _, data = run('{"reply": "abc", oops}')
+    assert text == "abc"
+    assert data["reply"] == "abc"
+
+
+def test_invalid_unicode_escape_does_not_raise():
+    raw = '{"reply": "abc\\uZZZZ"}'
+    text, _, data = run(raw)
+    assert text == "abc"
+    assert data == parse_reply(raw)
+
+
+@pytest.mark.parametrize("step", [1, 2, 4, 100])
+def test_fenced_plain_text_drops_fences(step):
+    text, diagrams, data = run("```markdown\nXin chào em\n\n`x` là ẩn\n```\n", step)
+    assert text == "Xin chào em\n\n`x` là ẩn"
+    assert data == {"reply": "Xin chào em\n\n`x` là ẩn", "diagram": None}
+    assert diagrams == []